@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import time
+import uuid
+from email.message import Message
+from http import HTTPStatus
+from optparse import OptionParser
+
+import redis.asyncio
+from redis.exceptions import RedisError
+
+import api
+import metrics
+import serializer
+from metrics import METRICS
+from scoring import get_interests_many_async, get_score_async
+from store import (
+    REDIS_CONFIG,
+    STORE_CONFIG,
+    CircuitOpenError,
+    count_cache_lookups,
+    history_cids,
+    interests_buckets,
+    interests_from_masks,
+    make_breaker,
+    make_local_cache,
+)
+from store import make_store as make_sync_store
+from store import masks_from_replies, queue_interests_reads, queue_interests_writes, queue_snapshot_reads
+
+MAX_HEADERS = 100
+
+
+class LengthRequired(ValueError):
+    """The body is not framed by Content-Length, its end is unknown."""
+
+
+_pool = None
+
+
+def get_connection_pool():
+    """Return the pool of the running event loop process, created on the first use."""
+    global _pool
+    if _pool is None:
+        config = dict(REDIS_CONFIG)
+        _pool = redis.asyncio.BlockingConnectionPool(
+            max_connections=config.pop("max_connections"),
+            timeout=config.pop("pool_timeout"),
+            encoding="utf-8",
+            decode_responses=True,
+            **config)
+    return _pool
+
+
+class AsyncStore:
+    """Store over an asyncio Redis client, mirrors store.Store."""
+
+    def __init__(self, redis=None, local_cache=None, breaker=None):
+        self._redis = redis
+        self.local_cache = local_cache
+        self.breaker = breaker
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = redis.asyncio.StrictRedis(connection_pool=get_connection_pool())
+        return self._redis
+
+    async def call(self, func, *args, **kwargs):
+        labels = (("command", getattr(func, "__name__", "unknown")),)
+        started = time.perf_counter()
+        try:
+            if self.breaker is None:
+                return await func(*args, **kwargs)
+            return await self.breaker.call_async(func, *args, **kwargs)
+        except Exception:
+            METRICS.inc("scoring_redis_errors_total", labels)
+            raise
+        finally:
+            METRICS.observe("scoring_redis_command_duration_seconds", time.perf_counter() - started, labels)
+
+    def cache_stats(self):
+        return self.local_cache.stats() if self.local_cache is not None else {}
+
+    def breaker_stats(self):
+        return self.breaker.stats() if self.breaker is not None else {}
+
+    async def cache_get(self, key):
+        result = self.local_cache.get(key) if self.local_cache is not None else None
+        if result is None:
+            result = await self.call(self.redis.get, key)
+            if result is not None and self.local_cache is not None:
+                self.local_cache.set(key, result)
+        count_cache_lookups(1 if result is not None else 0, 1)
+        return result
+
+    async def cache_set(self, key, score, ttl):
+        await self.call(self.redis.set, key, score, ttl)
+        if self.local_cache is not None:
+            self.local_cache.set(key, str(score), ttl)
+
+    async def set_interests_many(self, items, date=None):
+        current = None
+        if date is not None:
+            buckets = interests_buckets(items)
+            pipe = self.redis.pipeline(transaction=False)
+            queue_interests_reads(pipe, buckets)
+            current = masks_from_replies(buckets, await self.call(pipe.execute))
+        pipe = self.redis.pipeline(transaction=False)
+        queue_interests_writes(pipe, items, date, current)
+        await self.call(pipe.execute)
+
+    async def warmup(self):
+        try:
+            return bool(await self.call(self.redis.ping))
+        except (RedisError, CircuitOpenError) as e:
+            logging.exception(f'redis exception {e}')
+            return False
+
+    async def get(self, cid, date=None):
+        return (await self.read_interests([cid], date, raise_on_error=True))[cid]
+
+    async def get_many(self, cids, date=None):
+        """Fetch interests of several clients as Store.get_many."""
+        return await self.read_interests(cids, date, raise_on_error=False)
+
+    async def read_interests(self, cids, date, raise_on_error):
+        buckets = interests_buckets(cids)
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            queue_interests_reads(pipe, buckets)
+            masks = masks_from_replies(buckets, await self.call(pipe.execute, raise_on_error=raise_on_error))
+            snapshots = {}
+            history = history_cids(masks)
+            if history:
+                pipe = self.redis.pipeline(transaction=False)
+                queue_snapshot_reads(pipe, history, date)
+                snapshots = dict(zip(history, await self.call(pipe.execute, raise_on_error=raise_on_error)))
+        except RedisError as e:
+            logging.exception(f'redis exception {e}')
+            raise
+        return interests_from_masks(masks, snapshots)
+
+
+class LocalAsyncStore:
+    """Async interface of the memory and SQLite stores, their lookups are local and run on the event loop."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def cache_stats(self):
+        return self.store.cache_stats()
+
+    def breaker_stats(self):
+        return self.store.breaker_stats()
+
+    async def cache_get(self, key):
+        return self.store.cache_get(key)
+
+    async def cache_set(self, key, score, ttl):
+        self.store.cache_set(key, score, ttl)
+
+    async def set_interests_many(self, items, date=None):
+        self.store.set_interests_many(items, date)
+
+    async def warmup(self):
+        return self.store.warmup()
+
+    async def get(self, cid, date=None):
+        return self.store.get(cid, date)
+
+    async def get_many(self, cids, date=None):
+        return self.store.get_many(cids, date)
+
+
+def make_store(config=STORE_CONFIG, sync_store=None):
+    """Async store of the configured backend, a memory or SQLite one may wrap `sync_store` already created."""
+    if config["backend"] == "redis":
+        return AsyncStore(local_cache=make_local_cache(), breaker=make_breaker())
+    return LocalAsyncStore(sync_store if sync_store is not None else make_sync_store(config))
+
+
+async def method_handler(request, ctx, store):
+    ctx['has'] = []
+    request, error = api.parse_method_request(request["body"], ctx=ctx)
+    if error:
+        return error
+    ctx["method"] = request.method
+    return await METHODS[request.method](request, ctx, store)
+
+
+async def online_score_handler(request, ctx, store):
+    started = time.perf_counter()
+    scoring, error = api.validate_online_score(request, ctx)
+    started = api.add_timing(ctx, "validate", started)
+    if error:
+        return error
+    if request.is_admin:
+        score = 42
+    else:
+        score = await get_score_async(logging, store, scoring.phone, scoring.email, scoring.birthday,
+                                      scoring.gender, scoring.first_name, scoring.last_name)
+        api.add_timing(ctx, "store", started)
+    logging.info("Request is successfully proceeded.")
+    return {"score": score}, api.OK
+
+
+async def clients_interests_handler(request, ctx, store):
+    started = time.perf_counter()
+    interests, error = api.validate_clients_interests(request, ctx)
+    started = api.add_timing(ctx, "validate", started)
+    if error:
+        return error
+    response = dict()
+    pending = interests.client_ids
+    for _ in range(5):
+        try:
+            response.update(await get_interests_many_async(logging, store, pending, interests.date))
+        except CircuitOpenError:
+            break
+        except Exception:
+            pass
+        pending = [cid for cid in pending if cid not in response]
+        if not pending:
+            break
+    api.add_timing(ctx, "store", started)
+    return api.interests_result(interests, response, pending, ctx)
+
+
+METHODS = {
+    "online_score": online_score_handler,
+    "clients_interests": clients_interests_handler,
+}
+
+
+class AsyncHTTPServer:
+    """Minimal HTTP/1.1 server for the POST routes of the API with persistent connections."""
+    router = {
+        "method": method_handler
+    }
+    server_timing = api.SERVER_TIMING
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_request_id(self, headers):
+        return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
+
+    async def handle_post(self, path, data_string, headers):
+        started = time.perf_counter()
+        response, code = {}, api.OK
+        context = {"request_id": self.get_request_id(headers)}
+        request = None
+        try:
+            parse_started = time.perf_counter()
+            request = serializer.loads(data_string)
+            api.add_timing(context, "parse", parse_started)
+        except Exception as e:
+            logging.exception(f"Unexpected error: {e}")
+            code = api.BAD_REQUEST
+        route = path.strip("/")
+        if request:
+            logging.debug("%s %s", path, data_string)
+            if route in self.router:
+                try:
+                    response, code = await self.router[route]({"body": request, "headers": headers}, context, self.store)
+                except Exception as e:
+                    logging.exception(f"{context['request_id']} | Unexpected error: {e}")
+                    code = api.INTERNAL_ERROR
+            else:
+                code = api.NOT_FOUND
+        else:
+            logging.info(f"{context['request_id']} | Empty request")
+            code = api.INVALID_REQUEST
+            response = '_'
+        encode_started = time.perf_counter()
+        body = serializer.dumps(api.build_response(response, code))
+        duration = api.add_timing(context, "encode", encode_started) - started
+        headers = [f"Server-Timing: {api.server_timing(context, duration)}"] if self.server_timing else []
+        api.log_access(dict(context, path=path, code=code, duration_ms=round(duration * 1000, 3),
+                            timing=api.timing_ms(context)))
+        api.observe_request(route if route in self.router else "unknown", code, duration, context)
+        return code, body, headers
+
+    async def read_request(self, reader):
+        """Read the next request, its line, headers and body must all arrive within KEEP_ALIVE_TIMEOUT."""
+        return await asyncio.wait_for(self.read_request_parts(reader), api.KEEP_ALIVE_TIMEOUT)
+
+    async def read_request_parts(self, reader):
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        method, path, version = request_line.decode("latin-1").split()
+        headers = Message()
+        for _ in range(MAX_HEADERS):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip()] = value.strip()
+        if "Transfer-Encoding" in headers:
+            raise LengthRequired(f"Unsupported Transfer-Encoding: {headers['Transfer-Encoding']}")
+        lengths = set(headers.get_all("Content-Length", ["0"]))
+        length = lengths.pop()
+        if lengths or not length.isdigit():
+            raise ValueError(f"Invalid Content-Length: {headers.get_all('Content-Length')}")
+        length = int(length)
+        data_string = await reader.readexactly(length) if length else b""
+        return method, path, version, headers, data_string
+
+    async def handle_connection(self, reader, writer):
+        try:
+            for served in range(1, api.KEEP_ALIVE_MAX_REQUESTS + 1):
+                try:
+                    request = await self.read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError) as e:
+                    # the body cannot be skipped reliably, the rest of the stream is not parsed as requests
+                    code = 411 if isinstance(e, LengthRequired) else api.BAD_REQUEST
+                    writer.write(f"HTTP/1.1 {code} {HTTPStatus(code).phrase}\r\nContent-Length: 0\r\n"
+                                 "Connection: close\r\n\r\n".encode())
+                    break
+                if request is None:
+                    break
+                method, path, version, headers, data_string = request
+                connection = (headers.get("Connection") or "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                keep_alive = keep_alive and served < api.KEEP_ALIVE_MAX_REQUESTS
+                content_type, extra = "application/json", []
+                if method == "POST":
+                    code, body, extra = await self.handle_post(path, data_string, headers)
+                elif method == "GET" and path.strip("/") == "metrics":
+                    code, body, content_type = api.OK, api.render_metrics(self.store), metrics.CONTENT_TYPE
+                elif method == "GET":
+                    code, body = api.NOT_FOUND, b""
+                else:
+                    code, body = 501, b""
+                head = [f"HTTP/1.1 {code} {HTTPStatus(code).phrase}", f"Content-Type: {content_type}",
+                        f"Content-Length: {len(body)}", *extra,
+                        "Connection: keep-alive" if keep_alive else "Connection: close"]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await self.store.warmup()
+            await server.serve_forever()
+
+
+def run_server(port, sync_store=None):
+    """Serve on the event loop, `sync_store` is the store of api.MainHTTPHandler with the loaded memory interests."""
+    store = make_store(sync_store=sync_store)
+    logging.info(f"Starting asyncio server at {port}")
+    try:
+        asyncio.run(AsyncHTTPServer(store).serve("0.0.0.0", port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-p", "--port", action="store", type=int, default=8080)
+    op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--access-log", action="store", default=None)
+    op.add_option("--access-sample-rate", action="store", type=float, default=api.ACCESS_LOG_SAMPLE_RATE)
+    (opts, args) = op.parse_args()
+    api.setup_logging(opts.log, opts.access_log, sample_rate=opts.access_sample_rate)
+    try:
+        api.fill_memory_store(api.MainHTTPHandler.store)
+        run_server(opts.port, api.MainHTTPHandler.store)
+    finally:
+        api.stop_logging()
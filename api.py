@@ -1,19 +1,36 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import cProfile
+import csv
 import datetime
+import functools
 import hashlib
-import json
+import hmac
+import io
 import logging
+import logging.handlers
+import os
+import pstats
+import queue
+import random
 import re
+import signal
+import sys
+import threading
+import time
 import uuid
 import warnings
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from optparse import OptionParser
 
-import redis
-
-from scoring import get_interests, get_score
+import metrics
+import serializer
+from bulk_scoring import columns_from_rows, score_bulk
+from metrics import METRICS
+from scoring import get_interests_many, get_score, get_scores, score_ttl
+from store import Store  # noqa: F401 re-exported, existing code imports it from api
+from store import STORE_CONFIG, CircuitOpenError, configure_redis, encode_interests, make_local_cache, make_store
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
@@ -42,168 +59,206 @@ GENDERS = {
     FEMALE: "female",
 }
 
-interests_list = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
-
-try:
-    redis = redis.StrictRedis(
-        host='127.0.0.1',
-        port=6379,
-        password="mwMtyKVge8oLd2t81",
-        charset="utf-8",
-        decode_responses=True)
-except Exception as e:
-    logging.exception(f'Exception while redis connection: {e}')
-
+# (account, login) pairs whose expected token digest is kept in memory
+AUTH_CACHE_SIZE = 1024
+SERVER_MODES = ("thread", "fork", "async")
+# seconds an idle keep-alive connection is kept open
+KEEP_ALIVE_TIMEOUT = float(os.environ.get("KEEP_ALIVE_TIMEOUT", 15))
+# requests served over one connection before the server closes it
+KEEP_ALIVE_MAX_REQUESTS = int(os.environ.get("KEEP_ALIVE_MAX_REQUESTS", 1000))
+# NDJSON lines processed as one batch by the streaming route and command
+STREAM_CHUNK_SIZE = 500
+# send the per phase timing of every request in the Server-Timing header
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
 
-class Store:
-    def __init__(self, redis=redis):
-        self.redis = redis
 
-    def cache_get(self, key):
-        result = self.redis.get(key)
-        return result
-
-    def cache_set(self, key, score, ttl):
-        self.redis.set(key, score, ttl)
+class Fields:
+    """Declarative request field.
 
-    def upload_interests(self, interests_list):
-        [self.redis.sadd('interests_db', param) for param in interests_list]
+    The field object is shared by all requests of a class and holds only its settings;
+    validated values are stored in the request instance.
+    """
 
-    def get(self, cid):
-        try:
-            db_data = len(self.redis.smembers('interests_db'))
-            if db_data == 0:
-                self.upload_interests(interests_list)
-        except redis.exceptions as e:
-            logging.exception(f'redis exception {e}')
-        try:
-            any = self.redis.srandmember('interests_db', 2)
-        except redis.exceptions as e:
-            logging.exception(f'redis exception {e}')
-            raise redis.exceptions
-        return any
+    def __init__(self, required=False, nullable=False):
+        self.required = required
+        self.nullable = nullable
 
+    def __set_name__(self, owner, name):
+        self.name = name
 
-class CustomException(Exception):
-    pass
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return instance.__dict__.get(self.name)
 
+    def __set__(self, instance, value):
+        if value is not None:
+            value = self.clean(value)
+        instance.__dict__[self.name] = value
 
-class Fields:
-    def __init__(self, required, nullable):
-        self.required = required
-        self.nullable = nullable
+    def clean(self, value):
+        return value
 
 
 class CharField(Fields):
 
-    def __setattr__(self, name, value):
-        if name == 'value' and value is not None:
-            if not isinstance(value, str):
-                raise ValueError
-        self.__dict__[name] = value
+    def clean(self, value):
+        if not isinstance(value, str):
+            raise ValueError
+        return value
 
 
 class ArgumentsField(Fields):
 
-    def __setattr__(self, name, value):
-        if name == 'value' and value == {}:
+    def clean(self, value):
+        if value == {}:
             raise ValueError
-        self.__dict__[name] = value
+        return value
 
 
 class EmailField(CharField):
+    regex = re.compile(r'^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$')
 
-    def __setattr__(self, name, value):
-        if name == 'value':
-            regex = r'^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$'
-            if not re.match(regex, value):
-                raise ValueError
-        self.__dict__[name] = value
+    def clean(self, value):
+        if not isinstance(value, str) or not self.regex.match(value):
+            raise ValueError
+        return value
 
 
 class PhoneField(CharField):
+    regex = re.compile(r'^7\d{10}$')
 
-    def __setattr__(self, name, value):
-        if name == 'value':
-            regex = r'^7\d{10}$'
-            if re.match(regex, str(value)) or value is None:
-                value = str(value)
-            else:
-                raise ValueError
-        self.__dict__[name] = value
+    def clean(self, value):
+        value = str(value)
+        if not self.regex.match(value):
+            raise ValueError
+        return value
 
 
 class DateField(CharField):
+    # the day, month and year patterns of strptime('%d.%m.%Y'), used for dates not in the dd.mm.yyyy form
+    regex = re.compile(r'(3[01]|[12]\d|0[1-9]|[1-9])\.(1[0-2]|0[1-9]|[1-9])\.(\d\d\d\d)')
 
-    def __setattr__(self, name, value):
-        if name == 'value' and value is not None:
-            date_parts = value.split('.')
-            if len(date_parts) != 3 or not all(map(lambda x: x.isdigit(), date_parts)):
+    def clean(self, value):
+        if not isinstance(value, str):
+            raise ValueError
+        if len(value) == 10 and value[2] == value[5] == '.' and value.isascii():
+            day, month, year = value[:2], value[3:5], value[6:]
+            if not (day.isdigit() and month.isdigit() and year.isdigit()):
                 raise ValueError
-            try:
-                value = datetime.datetime.strptime(value, '%d.%m.%Y').date()
-            except Exception:
+        else:
+            match = self.regex.fullmatch(value)
+            if match is None:
                 raise ValueError
-        self.__dict__[name] = value
+            day, month, year = match.groups()
+        return datetime.date(int(year), int(month), int(day))
 
 
-class BirthDayField(CharField):
+_today = (0.0, None)
 
-    def __setattr__(self, name, value):
-        if name == 'value' and value is not None:
-            date_parts = value.split('.')
-            if len(date_parts) != 3 or not all(map(lambda x: x.isdigit(), date_parts)):
-                raise ValueError
-            current_date = datetime.date.today()
-            try:
-                value = datetime.datetime.strptime(value, '%d.%m.%Y').date()
-            except Exception:
-                raise ValueError
-            if int((current_date - value).days / 365.2425) > 70:
-                raise ValueError
-        self.__dict__[name] = value
 
+def today():
+    """datetime.date.today() recomputed only when the day changes."""
+    global _today
+    expires, date = _today
+    if time.time() >= expires:
+        date = datetime.date.today()
+        expires = datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time()).timestamp()
+        _today = (expires, date)
+    return date
 
-class GenderField(CharField):
 
-    def __setattr__(self, name, value):
-        if name == 'value' and value is not None:
-            if value not in [0, 1, 2]:
-                raise ValueError
+class BirthDayField(DateField):
 
-        self.__dict__[name] = value
+    def clean(self, value):
+        value = super().clean(value)
+        if int((today() - value).days / 365.2425) > 70:
+            raise ValueError
+        return value
 
 
-class ClientIDsField(object):
-    def __init__(self, required):
-        self.required = required
+class GenderField(CharField):
 
-    def __setattr__(self, name, value):
-        if name == 'value':
-            if len(value) > 0 and isinstance(value, list):
-                for id in value:
-                    if not isinstance(id, int):
-                        raise ValueError
-            else:
+    def clean(self, value):
+        if value not in [0, 1, 2]:
+            raise ValueError
+        return value
+
+
+class ClientIDsField(Fields):
+
+    def clean(self, value):
+        if not isinstance(value, list) or len(value) == 0:
+            raise ValueError
+        for id in value:
+            if not isinstance(id, int):
                 raise ValueError
-        self.__dict__[name] = value
+        return value
+
+
+class Validator:
+    """Validator compiled from the fields of a request class.
+
+    Walks the body in a single pass and collects errors instead of raising them.
+    Returns the filled request together with the names of the fields which are
+    present and valid, required but missing, and invalid.
+    """
+
+    def __init__(self, request_class):
+        self.request_class = request_class
+        self.fields = tuple(request_class.fields.items())
+
+    def __call__(self, body):
+        request = self.request_class()
+        values = request.__dict__
+        has, missing, invalid = [], [], []
+        for name, field in self.fields:
+            if name not in body:
+                if field.required:
+                    missing.append(name)
+                continue
+            value = body[name]
+            if value is None:
+                if not field.nullable:
+                    invalid.append(name)
+                    continue
+            else:
+                try:
+                    value = field.clean(value)
+                except ValueError:
+                    invalid.append(name)
+                    continue
+            values[name] = value
+            has.append(name)
+        return request, has, missing, invalid
+
+
+class Request:
+    """Base for request models: collects the declared fields, values live in the instance."""
+    fields = {}
+    validator = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.fields = {name: value for name, value in vars(cls).items() if isinstance(value, Fields)}
+        cls.validator = Validator(cls)
 
 
-class ClientsInterestsRequest:
+class ClientsInterestsRequest(Request):
     client_ids = ClientIDsField(required=True)
     date = DateField(required=False, nullable=True)
 
 
-class OnlineScoreRequest:
+class OnlineScoreRequest(Request):
     first_name = CharField(required=False, nullable=True)
     last_name = CharField(required=False, nullable=True)
-    email = EmailField(required=False, nullable=True)
     phone = PhoneField(required=False, nullable=True)
+    email = EmailField(required=False, nullable=True)
     birthday = BirthDayField(required=False, nullable=True)
     gender = GenderField(required=False, nullable=True)
 
 
-class MethodRequest:
+class MethodRequest(Request):
     account = CharField(required=False, nullable=True)
     login = CharField(required=True, nullable=True)
     token = CharField(required=True, nullable=True)
@@ -215,33 +270,35 @@ class MethodRequest:
         return self.login == ADMIN_LOGIN
 
 
+@functools.lru_cache(maxsize=AUTH_CACHE_SIZE)
+def user_digest(account, login):
+    return hashlib.sha512((account + login + SALT).encode()).hexdigest()
+
+
+_admin_digest = (0.0, None)
+
+
+def admin_digest():
+    """Digest of the current hour for the admin login, recomputed when the hour changes."""
+    global _admin_digest
+    expires, digest = _admin_digest
+    if time.time() >= expires:
+        now = datetime.datetime.now()
+        digest = hashlib.sha512((now.strftime("%Y%m%d%H") + ADMIN_SALT).encode()).hexdigest()
+        expires = (now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)).timestamp()
+        _admin_digest = (expires, digest)
+    return digest
+
+
 def check_auth(request):
     try:
         if request.is_admin:
-            digest = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode()).hexdigest()
+            digest = admin_digest()
         else:
-            digest = hashlib.sha512((request.account + request.login + SALT).encode()).hexdigest()
-        if digest == request.token:
-            return True
+            digest = user_digest(request.account, request.login)
+        return hmac.compare_digest(digest, request.token)
     except TypeError:
         return False
-    return False
-
-
-def validation(request, body, argument):
-    if argument not in body.keys():
-        if request.required:
-            logging.info(f'{argument} does not exist, but required')
-            raise KeyError
-        else:
-            logging.info(f'{argument} does not exist')
-            raise CustomException('Return empty value')
-    request.value = body[argument]
-    if hasattr(request, 'nullable'):
-        if not request.nullable and request.value is None:
-            logging.info(f'{argument} cant be null')
-            raise ValueError
-    return request.value
 
 
 def pair_validation(arguments):
@@ -254,245 +311,703 @@ def pair_validation(arguments):
     raise ValueError
 
 
-def method_handler(request, ctx, store):
-    response, code = '_', None
-    ctx['has'] = []
-    invalid = []
-    body = request["body"]
-    if body == {}:
-        logging.info("Invalid request body")
-        code = INVALID_REQUEST
-        return response, code
-    request = MethodRequest()
+def parse_method_request(body, auth=None, ctx=None):
+    """Validate the method request envelope and check it with `auth`, check_auth by default.
+
+    Validation and auth time is added to the timing of `ctx` when it is given.
 
+    Returns the request and None, or None and the (response, code) error pair.
+    """
+    response = '_'
+    if not body or not isinstance(body, dict):
+        logging.info("Invalid request body")
+        return None, (response, INVALID_REQUEST)
+    started = time.perf_counter()
+    request, _, missing, invalid = MethodRequest.validator(body)
+    errors = missing + invalid
+    started = add_timing(ctx, "validate", started)
+    if 'account' in errors or 'login' in errors or 'token' in errors:
+        return None, (response, INVALID_REQUEST)
+    authorized = (auth or check_auth)(request)
+    add_timing(ctx, "auth", started)
+    if not authorized:
+        logging.info("Authentication failed")
+        return None, (response, FORBIDDEN)
+    if 'arguments' in errors:
+        return None, (response, INVALID_REQUEST)
+    if 'method' in missing:
+        return None, (response, BAD_REQUEST)
+    if request.method not in METHODS:
+        logging.info(f"Unknown method {request.method}")
+        return None, (response, INVALID_REQUEST)
+    if not isinstance(request.arguments, dict):
+        logging.info("Invalid request arguments")
+        return None, (response, INVALID_REQUEST)
+    return request, None
+
+
+def validate_online_score(request, ctx):
+    scoring, ctx["has"], _, invalid = OnlineScoreRequest.validator(request.arguments)
     try:
-        param = request.account
-        request.account = validation(param, body, 'account')
+        pair_validation(ctx["has"])
     except ValueError:
-        code = INVALID_REQUEST
-        return response, code
-    except KeyError:
-        code = BAD_REQUEST
-        return response, code
-    except CustomException:
-        pass
+        logging.info('request does not satisfy validation policy')
+        return None, ('_', INVALID_REQUEST)
+    if invalid:
+        return None, (f"The following filed(s) are invalid: {','.join(invalid)}", INVALID_REQUEST)
+    return scoring, None
 
-    try:
-        param = request.login
-        request.login = validation(param, body, 'login')
-    except (ValueError, KeyError):
-        code = INVALID_REQUEST
-        return response, code
-    except CustomException:
-        pass
-    try:
-        param = request.token
-        request.token = validation(param, body, 'token')
-    except (ValueError, KeyError):
-        code = INVALID_REQUEST
-        return response, code
-    except CustomException:
-        pass
-    if check_auth(request):
+
+def validate_clients_interests(request, ctx):
+    ctx["nclients"] = 0
+    interests, _, missing, invalid = ClientsInterestsRequest.validator(request.arguments)
+    if 'client_ids' in missing or 'client_ids' in invalid:
+        return None, ('_', INVALID_REQUEST)
+    if invalid:
+        return None, (f"The following filed(s) are invalid: {','.join(invalid)}", INVALID_REQUEST)
+    return interests, None
+
+
+def interests_result(interests, response, pending, ctx):
+    ctx["nclients"] = sum(1 for cid in interests.client_ids if cid in response)
+    if pending:
+        return response, INTERNAL_ERROR
+    logging.info("Request is succesfuly proceeded.")
+    return response, OK
+
+
+def method_handler(request, ctx, store):
+    ctx['has'] = []
+    request, error = parse_method_request(request["body"], ctx=ctx)
+    if error:
+        return error
+    ctx["method"] = request.method
+    return METHODS[request.method](request, ctx, store)
+
+
+def online_score_handler(request, ctx, store):
+    started = time.perf_counter()
+    scoring, error = validate_online_score(request, ctx)
+    started = add_timing(ctx, "validate", started)
+    if error:
+        return error
+    if request.is_admin:
+        score = 42
+    else:
+        score = get_score(logging, store, scoring.phone, scoring.email, scoring.birthday, scoring.gender,
+                          scoring.first_name, scoring.last_name)
+        add_timing(ctx, "store", started)
+    logging.info("Request is successfully proceeded.")
+    return {"score": score}, OK
+
+
+def clients_interests_handler(request, ctx, store):
+    started = time.perf_counter()
+    interests, error = validate_clients_interests(request, ctx)
+    started = add_timing(ctx, "validate", started)
+    if error:
+        return error
+    response = dict()
+    pending = interests.client_ids
+    for _ in range(5):
         try:
-            param = request.arguments
-            request.arguments = validation(param, body, 'arguments')
-        except (ValueError, KeyError):
-            code = INVALID_REQUEST
-            return response, code
+            response.update(get_interests_many(logging, store, pending, interests.date))
+        except CircuitOpenError:
+            break
+        except Exception:
+            pass
+        pending = [cid for cid in pending if cid not in response]
+        if not pending:
+            break
+    add_timing(ctx, "store", started)
+    return interests_result(interests, response, pending, ctx)
+
+
+METHODS = {
+    "online_score": online_score_handler,
+    "clients_interests": clients_interests_handler,
+}
+
+
+def process_batch(requests, store):
+    """Run a list of method requests and return a list of their results.
+
+    Auth is checked once per distinct credentials. Scores of all online_score requests
+    are read from the cache with one MGET and written back with one pipeline.
+    """
+    checked = {}
+
+    def auth(request):
+        credentials = (request.account, request.login, request.token)
+        if credentials not in checked:
+            checked[credentials] = check_auth(request)
+        return checked[credentials]
+
+    results = [None] * len(requests)
+    scores = []
+    for i, item in enumerate(requests):
+        item_ctx = {"has": []}
+        method_request, error = parse_method_request(item, auth)
+        if error:
+            results[i] = error
+        elif method_request.method != "online_score":
+            results[i] = METHODS[method_request.method](method_request, item_ctx, store)
+        else:
+            scoring, error = validate_online_score(method_request, item_ctx)
+            if error:
+                results[i] = error
+            elif method_request.is_admin:
+                results[i] = ({"score": 42}, OK)
+            else:
+                scores.append((i, scoring))
+    people = [(s.phone, s.email, s.birthday, s.gender, s.first_name, s.last_name) for _, s in scores]
+    for (i, _), score in zip(scores, get_scores(logging, store, people)):
+        results[i] = ({"score": score}, OK)
+    return [build_response(response, code) for response, code in results]
+
+
+def batch_handler(request, ctx, store):
+    body = request["body"]
+    if not isinstance(body, list) or not body:
+        logging.info("Invalid batch body")
+        return '_', INVALID_REQUEST
+    ctx["batch_size"] = len(body)
+    response = process_batch(body, store)
+    logging.info("Batch is successfully proceeded.")
+    return response, OK
+
+
+def stream_handler(lines, store, chunk_size=STREAM_CHUNK_SIZE):
+    """Run NDJSON method requests and yield NDJSON results, one line per non-empty input line.
+
+    Lines are processed in chunks of `chunk_size` as batches, so memory stays bounded
+    and each chunk shares its Redis round trips. Every yielded value is one encoded chunk.
+    """
+    chunk = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
         try:
-            param = request.method
-            request.method = validation(param, body, 'method')
+            chunk.append(serializer.loads(line))
         except ValueError:
-            code = INVALID_REQUEST
-            return response, code
-        except KeyError:
-            code = BAD_REQUEST
-            return response, code
-        if request.method == 'online_score':
-            arguments = request.arguments
-            if arguments == {}:
-                logging.info("Invalid request arguments")
-                code = INVALID_REQUEST
-                return response, code
-            scoring = OnlineScoreRequest()
-            try:
-                param = scoring.first_name
-                scoring.first_name = validation(param, arguments, 'first_name')
-                ctx["has"].append("first_name")
-            except ValueError:
-                invalid.append('first_name')
-            except KeyError:
-                code = BAD_REQUEST
-                return response, code
-            except CustomException:
-                scoring.first_name = None
+            chunk.append(None)
+        if len(chunk) >= chunk_size:
+            yield b"".join(serializer.dumps(r) + b"\n" for r in process_batch(chunk, store))
+            chunk = []
+    if chunk:
+        yield b"".join(serializer.dumps(r) + b"\n" for r in process_batch(chunk, store))
+
+
+def read_people(source, fmt="jsonl"):
+    """Yield online_score arguments from a binary customer dump.
+
+    The dump is CSV with a header row, or JSONL with one object per line. A JSONL line may also be a whole method
+    request, then its arguments are used. Lines which are not JSON are yielded as None.
+    """
+    if fmt == "csv":
+        for row in csv.DictReader(io.TextIOWrapper(source, encoding="utf-8", newline="")):
+            person = {name: value for name, value in row.items() if value not in ("", None)}
+            if person.get("gender", "").isdigit():
+                person["gender"] = int(person["gender"])
+            yield person
+        return
+    for line in source:
+        if not line.strip():
+            continue
+        try:
+            person = serializer.loads(line)
+        except ValueError:
+            person = None
+        yield person.get("arguments", person) if isinstance(person, dict) else None
 
-            try:
-                param = scoring.last_name
-                scoring.last_name = validation(param, arguments, 'last_name')
-                ctx["has"].append("last_name")
-            except ValueError:
-                invalid.append('last_name')
-            except KeyError:
-                code = BAD_REQUEST
-                return response, code
-            except CustomException:
-                scoring.last_name = None
-            try:
-                param = scoring.phone
-                scoring.phone = validation(param, arguments, 'phone')
-                ctx["has"].append("phone")
-            except ValueError:
-                invalid.append('phone')
-            except KeyError:
-                code = BAD_REQUEST
-                return response, code
-            except CustomException:
-                scoring.phone = None
-            try:
-                param = scoring.email
-                scoring.email = validation(param, arguments, 'email')
-                ctx["has"].append("email")
-            except ValueError:
-                invalid.append('email')
-            except KeyError:
-                code = BAD_REQUEST
-                return response, code
-            except CustomException:
-                scoring.email = None
-            try:
-                param = scoring.birthday
-                scoring.birthday = validation(param, arguments, 'birthday')
-                ctx["has"].append("birthday")
-            except ValueError:
-                invalid.append('birthday')
-            except KeyError:
-                code = BAD_REQUEST
-                return response, code
-            except CustomException:
-                scoring.birthday = None
-            try:
-                param = scoring.gender
-                scoring.gender = validation(param, arguments, 'gender')
-                ctx["has"].append("gender")
-            except ValueError:
-                invalid.append('gender')
-            except KeyError:
-                code = BAD_REQUEST
-                return response, code
-            except CustomException:
-                scoring.gender = None
 
+def valid_person(person):
+    """The get_score arguments of valid online_score arguments, otherwise None."""
+    if not isinstance(person, dict):
+        return None
+    scoring, has, _, invalid = OnlineScoreRequest.validator(person)
+    try:
+        pair_validation(has)
+    except ValueError:
+        return None
+    if invalid:
+        return None
+    return scoring.phone, scoring.email, scoring.birthday, scoring.gender, scoring.first_name, scoring.last_name
+
+
+def warmup_scores(people, store, chunk_size=STREAM_CHUNK_SIZE):
+    """Write the scores of `people` to the cache with one pipelined write per chunk.
+
+    Yields the numbers of written and of skipped (invalid) people after every chunk,
+    so memory stays bounded by the chunk and the caller can report progress.
+    """
+    rows, skipped = [], 0
+    for person in people:
+        row = valid_person(person)
+        if row is None:
+            skipped += 1
+            continue
+        rows.append(row)
+        if len(rows) >= chunk_size:
+            yield write_scores(rows, store), skipped
+            rows, skipped = [], 0
+    if rows or skipped:
+        yield write_scores(rows, store), skipped
+
+
+def write_scores(rows, store):
+    keys, scores = score_bulk(columns_from_rows(rows))
+    if keys:
+        store.cache_set_many(dict(zip(keys, map(float, scores))), score_ttl)
+    return len(rows)
+
+
+def read_snapshot_date(value):
+    """The date of an interests row in the dd.mm.yyyy form of the API, None if there is none."""
+    if value in (None, ""):
+        return None
+    return datetime.datetime.strptime(value, "%d.%m.%Y").date()
+
+
+def read_interests(source, fmt="jsonl"):
+    """Yield (client id, interest names, snapshot date or None) from a binary dump of client interests.
+
+    JSONL lines are {"client_id": 1, "interests": ["cars", "pets"], "date": "20.07.2017"}, CSV has the columns
+    client_id, interests (the names separated by spaces) and date. The date is optional.
+    Rows which can not be read are yielded as None.
+    """
+    if fmt == "csv":
+        for row in csv.DictReader(io.TextIOWrapper(source, encoding="utf-8", newline="")):
+            cid = row.get("client_id") or ""
             try:
-                pair_validation(ctx["has"])
+                date = read_snapshot_date(row.get("date"))
             except ValueError:
-                logging.info('request does not satisfy validation policy')
-                code = INVALID_REQUEST
-                return response, code
-            except KeyError:
-                code = BAD_REQUEST
-                return response, code
+                cid = ""
+            yield (int(cid), (row.get("interests") or "").split(), date) if cid.isdigit() else None
+        return
+    for line in source:
+        if not line.strip():
+            continue
+        try:
+            row = serializer.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            yield None
+            continue
+        cid, names = row.get("client_id"), row.get("interests")
+        try:
+            date = read_snapshot_date(row.get("date"))
+        except (TypeError, ValueError):
+            yield None
+            continue
+        valid = isinstance(cid, int) and not isinstance(cid, bool) and cid >= 0 and isinstance(names, list)
+        yield (cid, names, date) if valid else None
 
-            if len(invalid) > 0:
-                code = INVALID_REQUEST
-                response = f"The following filed(s) are invalid: {','.join(invalid)}"
-                return response, code
-            else:
-                if request.is_admin:
-                    score = 42
-                else:
-                    score = get_score(logging, store, scoring.phone, scoring.email, scoring.birthday, scoring.gender,
-                                      scoring.first_name, scoring.last_name)
-                response = {"score": score}
-                logging.info("Request is successfully proceeded.")
-                code = OK
-
-        elif request.method == 'clients_interests':
-            invalid = []
-            ctx["nclients"] = 0
-            arguments = request.arguments
-            if arguments == {}:
-                logging.info("Invalid request arguments")
-                code = INVALID_REQUEST
-                return response, code
-            interests = ClientsInterestsRequest()
-            try:
-                param = interests.client_ids
-                interests.client_ids = validation(param, arguments, 'client_ids')
-            except (ValueError, KeyError):
-                code = INVALID_REQUEST
-                return response, code
 
+def load_interests(rows, store, chunk_size=STREAM_CHUNK_SIZE):
+    """Write the interests of clients with one bulk write per chunk and snapshot date.
+
+    Yields the numbers of written and of skipped rows after every chunk, a row with an unknown interest is skipped.
+    """
+    snapshots, count, skipped = {}, 0, 0
+    for row in rows:
+        try:
+            cid, names, date = row
+            encode_interests(names)
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+        snapshots.setdefault(date, {})[cid] = names
+        count += 1
+        if count >= chunk_size:
+            yield write_interests(snapshots, store), skipped
+            snapshots, count, skipped = {}, 0, 0
+    if snapshots or skipped:
+        yield write_interests(snapshots, store), skipped
+
+
+def write_interests(snapshots, store):
+    for date, items in snapshots.items():
+        store.set_interests_many(items, date)
+    return sum(len(items) for items in snapshots.values())
+
+
+def dump_format(path):
+    return "csv" if path is not None and path.lower().endswith(".csv") else "jsonl"
+
+
+def load_interests_file(source, fmt, store, chunk_size=STREAM_CHUNK_SIZE):
+    """Load every row of a dump of client interests, returns the numbers of written and of skipped rows."""
+    written = skipped = 0
+    for chunk_written, chunk_skipped in load_interests(read_interests(source, fmt), store, chunk_size):
+        written, skipped = written + chunk_written, skipped + chunk_skipped
+    return written, skipped
+
+
+def fill_memory_store(store, config=STORE_CONFIG):
+    """Load STORE_INTERESTS_FILE into the memory backend, which starts empty.
+
+    Runs before the workers of the fork mode are started, they get the loaded interests with the process memory.
+    """
+    if config["backend"] != "memory":
+        return
+    path = config["interests_file"]
+    if not path:
+        logging.info("STORE_INTERESTS_FILE is not set, the memory store has no interests")
+        return
+    started = time.perf_counter()
+    with open(path, "rb") as source:
+        written, skipped = load_interests_file(source, dump_format(path), store)
+    logging.info(f"Interests are loaded from {path}: {written} clients written, {skipped} skipped "
+                 f"in {time.perf_counter() - started:.1f} s")
+
+
+def read_chunked(rfile):
+    """Yield the blocks of a body sent with chunked transfer encoding."""
+    while True:
+        size = int(rfile.readline().split(b";")[0].strip(), 16)
+        if size == 0:
+            while rfile.readline() not in (b"\r\n", b"\n", b""):
+                pass
+            return
+        yield rfile.read(size)
+        rfile.readline()
+
+
+def read_blocks(rfile, length, block_size=io.DEFAULT_BUFFER_SIZE):
+    """Yield a body of `length` bytes in blocks."""
+    while length > 0:
+        block = rfile.read(min(block_size, length))
+        if not block:
+            return
+        length -= len(block)
+        yield block
+
+
+def iter_lines(blocks):
+    tail = b""
+    for block in blocks:
+        lines = (tail + block).split(b"\n")
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
+def add_timing(ctx, phase, started):
+    """Add the time passed since `started` to `phase` of the request timing and return the current time."""
+    now = time.perf_counter()
+    if ctx is not None:
+        timing = ctx.setdefault("timing", {})
+        timing[phase] = timing.get(phase, 0.0) + now - started
+    return now
+
+
+def timing_ms(ctx):
+    return {phase: round(seconds * 1000, 3) for phase, seconds in ctx.get("timing", {}).items()}
+
+
+def server_timing(ctx, total):
+    phases = [f"{phase};dur={ms}" for phase, ms in timing_ms(ctx).items()]
+    return ", ".join(phases + [f"total;dur={round(total * 1000, 3)}"])
+
+
+PROFILE_CONFIG = {
+    # share of requests run under cProfile, 0 disables profiling
+    "rate": float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+    "directory": os.environ.get("PROFILE_DIR", "profiles"),
+    # profiled requests between dumps of the aggregated stats
+    "dump_every": int(os.environ.get("PROFILE_DUMP_EVERY", 100)),
+}
+
+
+class Profiler:
+    """Runs a sampled share of requests under cProfile and dumps the aggregated stats to `directory`.
+
+    A process profiles one request at a time, concurrent requests are not sampled meanwhile.
+    The stats file is read with `python -m pstats profiles/api-<pid>.prof`.
+    """
+
+    def __init__(self, rate, directory, dump_every):
+        self.rate = rate
+        self.directory = directory
+        self.dump_every = dump_every
+        self.lock = threading.Lock()
+        self.stats = None
+        self.profiled = 0
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"api-{os.getpid()}.prof")
+
+    def run(self, func, *args):
+        if random.random() >= self.rate or not self.lock.acquire(blocking=False):
+            return func(*args)
+        try:
+            profile = cProfile.Profile()
             try:
-                param = interests.date
-                interests.date = validation(param, arguments, 'date')
-            except ValueError:
-                invalid.append('date')
-            except KeyError:
-                code = BAD_REQUEST
-                return response, code
-            except CustomException:
-                interests.date = None
-            if len(invalid) > 0:
-                code = INVALID_REQUEST
-                response = f"The following filed(s) are invalid: {','.join(invalid)}"
-                return response, code
-            else:
-                response = dict()
-                for cid in interests.client_ids:
-                    i = 0
-                    while i < 5:
-                        i += 1
-                        try:
-                            response[cid] = get_interests(logging, store, cid)
-                        except Exception:
-                            pass
-                        else:
-                            ctx["nclients"] += 1
-                            break
-                    if not response.get(cid):
-                        code = INTERNAL_ERROR
-                        return response, code
-
-                logging.info("Request is succesfuly proceeded.")
-                code = OK
+                return profile.runcall(func, *args)
+            finally:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+                self.profiled += 1
+                if self.profiled % self.dump_every == 0:
+                    self._dump()
+        finally:
+            self.lock.release()
+
+    def _dump(self):
+        if self.stats is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.stats.dump_stats(self.path)
+
+    def dump(self):
+        with self.lock:
+            self._dump()
+
+
+def make_profiler(config=PROFILE_CONFIG):
+    if config["rate"] <= 0:
+        return None
+    return Profiler(config["rate"], config["directory"], config["dump_every"])
+
+
+def dump_profile(handler_class):
+    if getattr(handler_class, "profiler", None) is not None:
+        handler_class.profiler.dump()
+
+
+LOG_FORMAT = '[%(asctime)s] %(levelname).1s %(message)s'
+LOG_DATE_FORMAT = '%Y.%m.%d %H:%M:%S'
+# share of successful requests written to the access log, errors are always written
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get("ACCESS_LOG_SAMPLE_RATE", 1))
+ACCESS_LOG = logging.getLogger("access")
+ACCESS_LOG.propagate = False
+
+_log_listener = None
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Puts records on the queue as they are, the messages are formatted by the listener thread."""
+
+    def prepare(self, record):
+        return record
+
+
+class LogFormatter(logging.Formatter):
+    """Formats access records as JSON lines and the other records with LOG_FORMAT."""
+
+    def __init__(self):
+        super().__init__(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+    def format(self, record):
+        if record.name == ACCESS_LOG.name:
+            return serializer.dumps({"time": self.formatTime(record, self.datefmt), **record.entry}).decode()
+        return super().format(record)
+
+
+def setup_logging(filename=None, access_filename=None, level=logging.INFO, sample_rate=ACCESS_LOG_SAMPLE_RATE):
+    """Route the application and access logs through a queue served by a background listener thread.
+
+    The access log goes to `access_filename`, or along with the application log when it is not set.
+    """
+    global _log_listener, ACCESS_LOG_SAMPLE_RATE
+    stop_logging()
+    ACCESS_LOG_SAMPLE_RATE = sample_rate
+    handler = logging.FileHandler(filename) if filename else logging.StreamHandler()
+    handler.setFormatter(LogFormatter())
+    handlers = [handler]
+    if access_filename and access_filename != filename:
+        access_handler = logging.FileHandler(access_filename)
+        access_handler.setFormatter(LogFormatter())
+        access_handler.addFilter(lambda record: record.name == ACCESS_LOG.name)
+        handler.addFilter(lambda record: record.name != ACCESS_LOG.name)
+        handlers.append(access_handler)
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [LazyQueueHandler(log_queue)]
+    root.setLevel(level)
+    ACCESS_LOG.handlers[:] = [LazyQueueHandler(log_queue)]
+    ACCESS_LOG.setLevel(logging.INFO)
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    return _log_listener
+
+
+def restart_logging():
+    """Start a listener over a new queue in a forked child, threads do not survive fork."""
+    global _log_listener
+    if _log_listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    for logger in (logging.getLogger(), ACCESS_LOG):
+        for handler in logger.handlers:
+            if isinstance(handler, LazyQueueHandler):
+                handler.queue = log_queue
+    _log_listener = logging.handlers.QueueListener(log_queue, *_log_listener.handlers, respect_handler_level=True)
+    _log_listener.start()
+
+
+def stop_logging():
+    """Write out the queued records, stop the listener thread and close its files.
+
+    The queue handlers are detached first, so no record is left in a queue nobody reads. Later records go to
+    the last resort handler of logging.
+    """
+    global _log_listener
+    if _log_listener is None:
+        return
+    for logger in (logging.getLogger(), ACCESS_LOG):
+        logger.handlers[:] = [handler for handler in logger.handlers if not isinstance(handler, LazyQueueHandler)]
+    _log_listener.stop()
+    for handler in _log_listener.handlers:
+        handler.close()
+    _log_listener = None
 
-    else:
-        logging.info("Authentication failed")
-        code = FORBIDDEN
-    return response, code
+
+def log_access(entry):
+    if entry["code"] < BAD_REQUEST and ACCESS_LOG_SAMPLE_RATE < 1 and random.random() >= ACCESS_LOG_SAMPLE_RATE:
+        return
+    ACCESS_LOG.info("access", extra={"entry": entry})
+
+
+def observe_request(route, code, duration, ctx):
+    labels = (("method", ctx.get("method", route)),)
+    METRICS.inc("scoring_requests_total", labels + (("code", code),))
+    METRICS.observe("scoring_request_duration_seconds", duration, labels)
+    if "nclients" in ctx:
+        METRICS.inc("scoring_clients_total", value=ctx["nclients"])
+
+
+def store_gauges(store):
+    hits = METRICS.counter("scoring_score_cache_total", (("result", "hit"),))
+    lookups = hits + METRICS.counter("scoring_score_cache_total", (("result", "miss"),))
+    gauges = [("scoring_score_cache_hit_ratio", "Share of score lookups served from the cache.",
+               [((), hits / lookups if lookups else 0.0)])]
+    pool_stats = getattr(store, "pool_stats", dict)
+    for prefix, stats in (("redis_pool", pool_stats()), ("local_cache", store.cache_stats()),
+                          ("redis_breaker", store.breaker_stats())):
+        for key, value in stats.items():
+            samples = [((("state", value),), 1)] if isinstance(value, str) else [((), value)]
+            gauges.append((f"scoring_{prefix}_{key}", f"{prefix.replace('_', ' ').capitalize()} {key}.", samples))
+    return gauges
+
+
+def render_metrics(store):
+    return METRICS.render(store_gauges(store)).encode()
+
+
+def build_response(response, code):
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    return {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
 
 
 class MainHTTPHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+    # headers and body go out in one segment on flush, small writes are not delayed on persistent connections
+    wbufsize = io.DEFAULT_BUFFER_SIZE
+    disable_nagle_algorithm = True
+    max_requests = KEEP_ALIVE_MAX_REQUESTS
+    server_timing = SERVER_TIMING
     router = {
-        "method": method_handler
+        "method": method_handler,
+        "batch": batch_handler,
     }
 
-    try:
-        store = Store()
-    except redis.exceptions.ConnectionError:
-        store = None
+    store = make_store(local_cache=make_local_cache())
+    profiler = make_profiler()
+
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
+        self.close_announced = False
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        self.requests_served += 1
+        if self.requests_served >= self.max_requests:
+            self.close_connection = True
+        return True
+
+    def send_header(self, keyword, value):
+        super().send_header(keyword, value)
+        if keyword.lower() == "connection" and value.lower() == "close":
+            self.close_announced = True
+
+    def end_headers(self):
+        # every response which ends the connection says so, whichever handler has sent it
+        if self.close_connection and not self.close_announced:
+            self.send_header("Connection", "close")
+        self.close_announced = False
+        super().end_headers()
 
     def get_request_id(self, headers):
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
+    def log_request(self, code="-", size="-"):
+        # requests are written to the access log by log_access
+        pass
+
+    def log_message(self, format, *args):
+        logging.info("%s - " + format, self.address_string(), *args)
+
+    def do_GET(self):
+        if self.path.strip("/") != "metrics":
+            return self.send_error(NOT_FOUND)
+        try:
+            body = render_metrics(self.store)
+        except Exception as e:
+            logging.exception(f"Metrics are not collected: {e}")
+            return self.send_error(INTERNAL_ERROR)
+        self.send_response(OK)
+        self.send_header("Content-Type", metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_POST(self):
+        route = self.path.strip("/")
+        if route == "stream":
+            return self.do_stream()
+        started = time.perf_counter()
         response, code = {}, OK
         context = {"request_id": self.get_request_id(self.headers)}
         request = None
         try:
-            data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
+            length = int(self.headers['Content-Length'])
+            if length < 0:
+                raise ValueError(f"Invalid Content-Length: {length}")
+            data_string = self.rfile.read(length)
         except Exception as e:
             logging.exception(f"Unexpected error: {e}")
             code = BAD_REQUEST
+            # the unread body would be parsed as the next request
+            self.close_connection = True
+        else:
+            try:
+                parse_started = time.perf_counter()
+                request = serializer.loads(data_string)
+                add_timing(context, "parse", parse_started)
+            except Exception as e:
+                logging.exception(f"Unexpected error: {e}")
+                code = BAD_REQUEST
         if request:
-            path = self.path.strip("/")
-            logging.info(f"{self.path} {data_string}")
-            if path in self.router:
+            logging.debug("%s %s", self.path, data_string)
+            if route in self.router:
+                args = ({"body": request, "headers": self.headers}, context, self.store)
                 try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
+                    if self.profiler is not None:
+                        response, code = self.profiler.run(self.router[route], *args)
+                    else:
+                        response, code = self.router[route](*args)
                 except Exception as e:
                     logging.exception(f"{context['request_id']} | Unexpected error: {e}")
                     code = INTERNAL_ERROR
@@ -503,30 +1018,167 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
             code = INVALID_REQUEST
             response = '_'
 
+        encode_started = time.perf_counter()
+        body = serializer.dumps(build_response(response, code))
+        add_timing(context, "encode", encode_started)
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.server_timing:
+            self.send_header("Server-Timing", server_timing(context, time.perf_counter() - started))
         self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
+        self.wfile.write(body)
+        duration = time.perf_counter() - started
+        log_access(dict(context, path=self.path, code=code, duration_ms=round(duration * 1000, 3),
+                        timing=timing_ms(context)))
+        observe_request(route if route in self.router else "unknown", code, duration, context)
+
+    def do_stream(self):
+        started = time.perf_counter()
+        request_id = self.get_request_id(self.headers)
+        if (self.headers.get("Transfer-Encoding") or "").lower() == "chunked":
+            blocks = read_chunked(self.rfile)
         else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r).encode())
-        return
+            blocks = read_blocks(self.rfile, int(self.headers.get("Content-Length") or 0))
+        self.send_response(OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for data in stream_handler(iter_lines(blocks), self.store):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+        except ValueError as e:
+            logging.exception(f"{request_id} | Broken stream: {e}")
+            self.close_connection = True
+            return
+        self.wfile.write(b"0\r\n\r\n")
+        observe_request("stream", OK, time.perf_counter() - started, {})
+        logging.info(f"{request_id} | Stream is successfully proceeded.")
+
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
+
+
+def serve_forked(server, workers):
+    """Pre-fork `workers` processes which accept connections on the already bound server socket."""
+    signal.signal(signal.SIGTERM, _terminate)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            restart_logging()
+            try:
+                server.serve_forever()
+            finally:
+                dump_profile(server.RequestHandlerClass)
+                stop_logging()
+                os._exit(0)
+        children.append(pid)
+    logging.info(f"Started {workers} worker(s): {children}")
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
+
+def run_server(port, mode="thread", workers=1):
+    if mode not in SERVER_MODES:
+        raise ValueError(f"Unknown server mode: {mode}")
+    fill_memory_store(MainHTTPHandler.store)
+    if mode == "async":
+        import aioapi
+        return aioapi.run_server(port, MainHTTPHandler.store)
+    if mode == "fork":
+        configure_redis(workers)
+    # workers of the fork mode are threaded too, otherwise one idle keep-alive connection holds a whole process
+    server = ThreadingHTTPServer(("0.0.0.0", port), MainHTTPHandler)
+    if MainHTTPHandler.store is not None and not MainHTTPHandler.store.warmup():
+        logging.info("Store is not available, lookups will retry it")
+    logging.info(f"Starting server at {port}, mode: {mode}, workers: {workers}")
+    try:
+        if mode == "fork":
+            serve_forked(server, workers)
+        else:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    dump_profile(MainHTTPHandler)
 
 
-if __name__ == "__main__":
+def main():
+    """Command line entry point: run the server or one of the offline commands."""
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--access-log", action="store", default=None)
+    op.add_option("--access-sample-rate", action="store", type=float, default=ACCESS_LOG_SAMPLE_RATE)
+    op.add_option("-m", "--mode", action="store", type="choice", choices=SERVER_MODES, default="thread")
+    op.add_option("-w", "--workers", action="store", type=int, default=1)
+    op.add_option("--chunk-size", action="store", type=int, default=STREAM_CHUNK_SIZE)
+    op.set_usage("%prog [options]\n       %prog [options] stream [INPUT.jsonl [OUTPUT.jsonl]]"
+                 "\n       %prog [options] warmup [CUSTOMERS.csv|CUSTOMERS.jsonl]"
+                 "\n       %prog [options] interests [INTERESTS.csv|INTERESTS.jsonl]")
     (opts, args) = op.parse_args()
-    logging.basicConfig(filename=None, level=logging.INFO,
-                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("0.0.0.0", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        pass
-    server.server_close()
+    if args[:1] == ["stream"]:
+        # per request messages of a bulk run are not interesting, only warnings are logged
+        setup_logging(opts.log, level=logging.WARNING)
+        source = open(args[1], "rb") if len(args) > 1 else sys.stdin.buffer
+        target = open(args[2], "wb") if len(args) > 2 else sys.stdout.buffer
+        MainHTTPHandler.store.warmup()
+        with source, target:
+            for data in stream_handler(source, MainHTTPHandler.store, opts.chunk_size):
+                target.write(data)
+    elif args[:1] in (["warmup"], ["interests"]) and STORE_CONFIG["backend"] == "memory":
+        op.error(f"{args[0]}: the memory store lives in the server process, "
+                 "its interests are loaded from STORE_INTERESTS_FILE at start")
+    elif args[:1] == ["warmup"]:
+        setup_logging(opts.log)
+        source = open(args[1], "rb") if len(args) > 1 else sys.stdin.buffer
+        fmt = dump_format(args[1] if len(args) > 1 else None)
+        # the scores are not read back by this process, the local cache is not filled
+        store = make_store()
+        written = skipped = 0
+        started = reported = time.perf_counter()
+        with source:
+            for chunk_written, chunk_skipped in warmup_scores(read_people(source, fmt), store, opts.chunk_size):
+                written, skipped = written + chunk_written, skipped + chunk_skipped
+                if time.perf_counter() - reported >= 1:
+                    reported = time.perf_counter()
+                    logging.info(f"{written} scores written, {written / (reported - started):.0f}/s")
+        elapsed = time.perf_counter() - started
+        logging.info(f"Warmup is finished: {written} scores written, {skipped} skipped in {elapsed:.1f} s, "
+                     f"{written / elapsed if elapsed else 0:.0f} scores/s")
+    elif args[:1] == ["interests"]:
+        setup_logging(opts.log)
+        source = open(args[1], "rb") if len(args) > 1 else sys.stdin.buffer
+        fmt = dump_format(args[1] if len(args) > 1 else None)
+        store = make_store()
+        started = time.perf_counter()
+        with source:
+            written, skipped = load_interests_file(source, fmt, store, opts.chunk_size)
+        elapsed = time.perf_counter() - started
+        logging.info(f"Interests are loaded: {written} clients written, {skipped} skipped in {elapsed:.1f} s")
+    elif args:
+        op.error(f"unknown command: {args[0]}")
+    else:
+        setup_logging(opts.log, opts.access_log, sample_rate=opts.access_sample_rate)
+        run_server(opts.port, opts.mode, opts.workers)
+    stop_logging()
+
+
+if __name__ == "__main__":
+    # aioapi imports `api`: let it get this module, a second copy would not see the settings made by main()
+    sys.modules.setdefault("api", sys.modules[__name__])
+    main()
@@ -0,0 +1,63 @@
+"""Cost of check_auth per request.
+
+Compares the memoized check_auth with the previous implementation, which
+computed the sha512 digest (and the admin hour string) on every request.
+
+Usage: python -m benchmarks.bench_auth [-n 200000]
+"""
+import datetime
+import hashlib
+import time
+from optparse import OptionParser
+
+import api
+
+
+def legacy_check_auth(request):
+    try:
+        if request.is_admin:
+            digest = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT).encode()).hexdigest()
+        else:
+            digest = hashlib.sha512((request.account + request.login + api.SALT).encode()).hexdigest()
+        if digest == request.token:
+            return True
+    except TypeError:
+        return False
+    return False
+
+
+def make_request(account, login):
+    request = api.MethodRequest()
+    request.account = account
+    request.login = login
+    if request.is_admin:
+        request.token = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT).encode()).hexdigest()
+    else:
+        request.token = hashlib.sha512((account + login + api.SALT).encode()).hexdigest()
+    return request
+
+
+def bench(check, requests, number):
+    started = time.perf_counter()
+    for i in range(number):
+        check(requests[i % len(requests)])
+    return (time.perf_counter() - started) / number * 1e6
+
+
+def main(number):
+    cases = {
+        "user": [make_request("horns&hoofs", "h&f")],
+        "user, 100 accounts": [make_request(f"account{i}", "h&f") for i in range(100)],
+        "admin": [make_request("horns&hoofs", api.ADMIN_LOGIN)],
+    }
+    for name, requests in cases.items():
+        legacy = bench(legacy_check_auth, requests, number)
+        memoized = bench(api.check_auth, requests, number)
+        print(f"{name:<24}{legacy:>8.2f} us -> {memoized:.2f} us per request")
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--number", action="store", type=int, default=200000)
+    (opts, args) = op.parse_args()
+    main(opts.number)
@@ -0,0 +1,45 @@
+"""Offline scoring of many people: row by row against bulk_scoring over columns.
+
+Usage: python -m benchmarks.bench_bulk_scoring [-n 200000]
+"""
+import datetime
+import random
+import time
+from optparse import OptionParser
+
+import bulk_scoring
+from scoring import calculate_score, get_score_key
+
+
+def make_rows(number, seed=0):
+    rnd = random.Random(seed)
+    birthdays = [datetime.date(1950, 1, 1) + datetime.timedelta(days=rnd.randrange(25000)) for _ in range(1000)]
+    return [(f"7{rnd.randrange(10 ** 10):010d}" if rnd.random() < 0.8 else None,
+             f"user{i}@otus.ru" if rnd.random() < 0.7 else None,
+             rnd.choice(birthdays) if rnd.random() < 0.6 else None,
+             rnd.choice((None, 0, 1, 2)),
+             "first" if rnd.random() < 0.5 else None,
+             "last" if rnd.random() < 0.5 else None) for i in range(number)]
+
+
+def row_by_row(rows):
+    return ([get_score_key(phone, email, birthday, first_name, last_name)
+             for phone, email, birthday, gender, first_name, last_name in rows],
+            [calculate_score(*row) for row in rows])
+
+
+def main(number):
+    rows = make_rows(number)
+    columns = bulk_scoring.columns_from_rows(rows)
+    backend = "numpy" if bulk_scoring.numpy is not None else "lists"
+    for name, func, arg in (("row by row", row_by_row, rows), (f"bulk ({backend})", bulk_scoring.score_bulk, columns)):
+        started = time.perf_counter()
+        func(arg)
+        print(f"{name:<24}{number / (time.perf_counter() - started):>12.0f} rows/s")
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--number", action="store", type=int, default=200000)
+    (opts, args) = op.parse_args()
+    main(opts.number)
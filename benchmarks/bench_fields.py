@@ -0,0 +1,41 @@
+"""Microbenchmark of field validation over the fixtures of tests/unit/test_api.py.
+
+Assigns every valid and invalid fixture value to an OnlineScoreRequest and prints
+assignments per second for each field.
+
+Usage: python -m benchmarks.bench_fields [-n 20000]
+"""
+import time
+from collections import defaultdict
+from optparse import OptionParser
+
+import api
+from tests.unit.test_api import INVALID_FIELDS, VALID_FIELDS
+
+
+def bench(values, number):
+    request = api.OnlineScoreRequest()
+    started = time.perf_counter()
+    for _ in range(number):
+        for name, value in values:
+            try:
+                setattr(request, name, value)
+            except ValueError:
+                pass
+    return number * len(values) / (time.perf_counter() - started)
+
+
+def main(number):
+    for kind, fixtures in (("valid", VALID_FIELDS), ("invalid", INVALID_FIELDS)):
+        fields = defaultdict(list)
+        for name, value in fixtures:
+            fields[name].append((name, value))
+        for name, values in fields.items():
+            print(f"{name + ' ' + kind:<24}{bench(values, number):>12.0f} values/s")
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--number", action="store", type=int, default=20000)
+    (opts, args) = op.parse_args()
+    main(opts.number)
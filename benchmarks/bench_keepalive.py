@@ -0,0 +1,71 @@
+"""Throughput of MainHTTPHandler with and without HTTP keep-alive.
+
+Starts the threaded server on a free local port with an in-memory store and sends
+online_score requests from several client threads, either over one persistent
+connection per thread or over a new connection per request.
+
+Usage: python -m benchmarks.bench_keepalive [-n 2000] [-c 4]
+"""
+import http.client
+import json
+import logging
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from optparse import OptionParser
+
+import api
+from benchmarks.bench_validation import CASES, DictStore, check
+
+
+class Handler(api.MainHTTPHandler):
+    store = DictStore()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def client(port, number, keep_alive, body):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {} if keep_alive else {"Connection": "close"}
+    for _ in range(number):
+        connection.request("POST", "/method", body, headers)
+        connection.getresponse().read()
+        if not keep_alive:
+            connection.close()
+    connection.close()
+
+
+def bench(port, number, concurrency, keep_alive):
+    body = json.dumps(CASES["online_score valid"])
+    threads = [threading.Thread(target=client, args=(port, number // concurrency, keep_alive, body))
+               for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return number // concurrency * concurrency / (time.perf_counter() - started)
+
+
+def main(number, concurrency):
+    logging.disable(logging.CRITICAL)
+    check("online_score valid", Handler.store)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    try:
+        for keep_alive in (False, True):
+            name = "keep-alive" if keep_alive else "connection per request"
+            print(f"{name:<28}{bench(port, number, concurrency, keep_alive):>12.0f} req/s")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--number", action="store", type=int, default=2000)
+    op.add_option("-c", "--concurrency", action="store", type=int, default=4)
+    (opts, args) = op.parse_args()
+    main(opts.number, opts.concurrency)
@@ -0,0 +1,153 @@
+"""Load test of the HTTP API replaying NDJSON traffic at a fixed concurrency.
+
+Every line of the traffic file is a method request, the same format the stream
+command reads. `concurrency` client threads send the lines round robin to
+POST /method over keep-alive connections until `number` requests are done.
+Without --url an in-process threaded server over fakeredis is started. Without
+a traffic file a mix of valid, invalid and unauthorized requests is generated;
+--generate FILE only writes that mix to FILE.
+
+Usage: python -m benchmarks.bench_load [traffic.jsonl] [--url http://127.0.0.1:8080] [-n 5000] [-c 8]
+           [--format json] [--output results.jsonl]
+       python -m benchmarks.bench_load --generate traffic.jsonl [-n 5000]
+"""
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer
+from optparse import OptionParser
+from urllib.parse import urlsplit
+
+import api
+from benchmarks.bench_validation import CASES, with_auth
+from benchmarks.report import summarize, write_results
+from store import Store, interests_list, make_breaker, make_local_cache
+
+# share of every kind of request in the generated traffic
+TRAFFIC_MIX = {
+    "online_score valid": 5,
+    "online_score repeated": 2,
+    "online_score partial": 1,
+    "online_score invalid": 1,
+    "clients_interests valid": 1,
+    "clients_interests invalid": 1,
+    "bad auth": 1,
+}
+
+
+def generate_traffic(number, seed=0):
+    """Return `number` request lines, new online_score people miss the score cache, repeated ones hit it."""
+    rnd = random.Random(seed)
+    kinds = rnd.choices(list(TRAFFIC_MIX), weights=list(TRAFFIC_MIX.values()), k=number)
+    lines = []
+    for kind in kinds:
+        if kind == "online_score valid":
+            arguments = dict(CASES[kind]["arguments"], phone=f"7{rnd.randrange(10 ** 10):010d}")
+            body = dict(CASES[kind], arguments=arguments)
+        elif kind == "online_score repeated":
+            body = CASES["online_score valid"]
+        elif kind == "clients_interests valid":
+            arguments = {"client_ids": rnd.sample(range(1000), rnd.randint(1, 20)), "date": "20.07.2017"}
+            body = dict(CASES[kind], arguments=arguments)
+        else:
+            body = CASES[kind]
+        lines.append(json.dumps(body).encode())
+    return lines
+
+
+def read_traffic(path):
+    with open(path, "rb") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    # admin tokens are valid for an hour only, requests are signed again with the current one
+    return [json.dumps(with_auth(request)).encode() if request.get("login") == api.ADMIN_LOGIN else line
+            for line, request in ((line, json.loads(line)) for line in lines)]
+
+
+def client(host, port, lines, latencies, codes):
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    timer = time.perf_counter
+    try:
+        for line in lines:
+            started = timer()
+            try:
+                connection.request("POST", "/method", line, {"Content-Type": "application/json"})
+                response = connection.getresponse()
+                response.read()
+                codes[response.status] += 1
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                codes["error"] += 1
+                continue
+            latencies.append(timer() - started)
+    finally:
+        connection.close()
+
+
+def run_load(host, port, traffic, number, concurrency):
+    """Send `number` requests from `concurrency` threads, return latencies, wall time and response codes."""
+    latencies = [[] for _ in range(concurrency)]
+    codes = [Counter() for _ in range(concurrency)]
+    lines = [traffic[i % len(traffic)] for i in range(number)]
+    threads = [threading.Thread(target=client, args=(host, port, lines[i::concurrency], latencies[i], codes[i]))
+               for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return [latency for thread_latencies in latencies for latency in thread_latencies], elapsed, sum(codes, Counter())
+
+
+def local_server():
+    import fakeredis
+
+    class Handler(api.MainHTTPHandler):
+        store = Store(fakeredis.FakeStrictRedis(decode_responses=True), local_cache=make_local_cache(), breaker=make_breaker())
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Handler.store.warmup()
+    Handler.store.set_interests_many({cid: interests_list[cid % 5:cid % 5 + 2] for cid in range(1000)})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(path, url, number, concurrency, fmt, output):
+    logging.disable(logging.CRITICAL)
+    traffic = read_traffic(path) if path else generate_traffic(number)
+    server = None
+    if url:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        server = local_server()
+        host, port = server.server_address
+    try:
+        latencies, elapsed, codes = run_load(host, port, traffic, number, concurrency)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    result = summarize("load", f"method c={concurrency}", latencies, elapsed, concurrency=concurrency,
+                       server=url or "local", codes={str(code): count for code, count in sorted(codes.items(), key=str)})
+    write_results([result], fmt, output)
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] [traffic.jsonl]")
+    op.add_option("--url", action="store", default=None)
+    op.add_option("-n", "--number", action="store", type=int, default=5000)
+    op.add_option("-c", "--concurrency", action="store", type=int, default=8)
+    op.add_option("--generate", action="store", default=None)
+    op.add_option("--format", action="store", type="choice", choices=("table", "json"), default="table")
+    op.add_option("--output", action="store", default=None)
+    (opts, args) = op.parse_args()
+    if opts.generate:
+        with open(opts.generate, "wb") as f:
+            f.writelines(line + b"\n" for line in generate_traffic(opts.number))
+    else:
+        main(args[0] if args else None, opts.url, opts.number, opts.concurrency, opts.format, opts.output)
@@ -0,0 +1,101 @@
+"""Microbenchmarks of the request path: get_score, get_interests, check_auth and validation.
+
+Every operation is timed separately, the result has throughput and p50/p99
+latency per case. The store is fakeredis by default, with --redis the Redis
+configured by the REDIS_* environment variables is used. The benchmark writes
+scores and interests there, so that database (REDIS_DB) must be dedicated to
+it: the run refuses a non-empty database and flushes it when finished.
+
+Usage: python -m benchmarks.bench_micro [-n 20000] [--redis] [--format json] [--output results.jsonl]
+"""
+import datetime
+import logging
+import time
+import uuid
+from optparse import OptionParser
+
+import api
+from benchmarks.bench_auth import make_request
+from benchmarks.bench_validation import CASES
+from benchmarks.report import summarize, write_results
+from scoring import get_interests, get_interests_many, get_score
+from store import REDIS_CONFIG, Store, interests_list
+
+
+def make_store(use_redis):
+    if use_redis:
+        return Store()
+    import fakeredis
+    return Store(fakeredis.FakeStrictRedis(decode_responses=True))
+
+
+def person(i, first_name="a"):
+    return f"7{i:010d}", f"user{i}@otus.ru", datetime.date(2000, 1, 1), 1, first_name, "b"
+
+
+def measure(func, calls, number):
+    latencies = []
+    timer = time.perf_counter
+    started = timer()
+    for i in range(number):
+        call_started = timer()
+        func(*calls[i % len(calls)])
+        latencies.append(timer() - call_started)
+    return latencies, timer() - started
+
+
+def cases(store, number):
+    # a unique person per call misses the cache
+    run = uuid.uuid4().hex[:8]
+    misses = [(logging, store, *person(i, run)) for i in range(number)]
+    hits = [(logging, store, *person(0))]
+    get_score(*hits[0])
+    store.warmup()
+    store.set_interests_many({cid: interests_list[cid % 5:cid % 5 + 2] for cid in range(100)})
+    for month in range(1, 13):
+        store.set_interests_many({cid: interests_list[month % 5:month % 5 + 2] for cid in range(100, 200)},
+                                 datetime.date(2017, month, 1))
+    arguments = CASES["online_score valid"]["arguments"]
+    interests = CASES["clients_interests valid"]["arguments"]
+    return {
+        "get_score miss": (get_score, misses),
+        "get_score hit": (get_score, hits),
+        "get_interests": (get_interests, [(logging, store, 1)]),
+        "get_interests_many x100": (get_interests_many, [(logging, store, list(range(100)))]),
+        "get_interests_many x100 dated": (get_interests_many, [(logging, store, list(range(100, 200)),
+                                                                datetime.date(2017, 7, 20))]),
+        "check_auth user": (api.check_auth, [(make_request("horns&hoofs", "h&f"),)]),
+        "check_auth admin": (api.check_auth, [(make_request("horns&hoofs", api.ADMIN_LOGIN),)]),
+        "validate online_score": (api.OnlineScoreRequest.validator, [(arguments,)]),
+        "validate clients_interests": (api.ClientsInterestsRequest.validator, [(interests,)]),
+        "method_handler online_score": (api.method_handler, [({"body": CASES["online_score valid"], "headers": {}},
+                                                              {}, store)]),
+    }
+
+
+def main(number, use_redis, fmt, output):
+    logging.disable(logging.CRITICAL)
+    store = make_store(use_redis)
+    if use_redis and store.redis.dbsize():
+        raise SystemExit(f"Redis database {REDIS_CONFIG['db']} is not empty, "
+                         f"set REDIS_DB to a database dedicated to the benchmark")
+    results = []
+    try:
+        for name, (func, calls) in cases(store, number).items():
+            latencies, elapsed = measure(func, calls, number)
+            results.append(summarize("micro", name, latencies, elapsed, store="redis" if use_redis else "fakeredis"))
+    finally:
+        if use_redis:
+            # the database was empty before the run, everything in it has been written by the benchmark
+            store.redis.flushdb()
+    write_results(results, fmt, output)
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--number", action="store", type=int, default=20000)
+    op.add_option("--redis", action="store_true", default=False)
+    op.add_option("--format", action="store", type="choice", choices=("table", "json"), default="table")
+    op.add_option("--output", action="store", default=None)
+    (opts, args) = op.parse_args()
+    main(opts.number, opts.redis, opts.format, opts.output)
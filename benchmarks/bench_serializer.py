@@ -0,0 +1,44 @@
+"""Encode and decode throughput of the JSON backends of serializer.py.
+
+Decodes a realistic online_score request and a clients_interests request with many
+client ids, and encodes the matching responses, with every available backend.
+
+Usage: python -m benchmarks.bench_serializer [-n 20000] [--clients 1000]
+"""
+import time
+from optparse import OptionParser
+
+import api
+import serializer
+from benchmarks.bench_validation import CASES
+
+
+def bench(func, payload, number):
+    started = time.perf_counter()
+    for _ in range(number):
+        func(payload)
+    return number / (time.perf_counter() - started)
+
+
+def main(number, clients):
+    interests = dict(CASES["clients_interests valid"], arguments={"client_ids": list(range(clients))})
+    payloads = {
+        "online_score": (CASES["online_score valid"], api.build_response({"score": 5.0}, api.OK), number),
+        f"clients_interests x{clients}": (
+            interests, api.build_response({cid: ["hi-tech", "travel"] for cid in range(clients)}, api.OK),
+            max(1, number * 10 // clients)),
+    }
+    for name, (request, response, count) in payloads.items():
+        data = serializer.json_dumps(request)
+        for backend, (dumps, loads) in serializer.BACKENDS.items():
+            decode = bench(loads, data, count)
+            encode = bench(dumps, response, count)
+            print(f"{name:<28}{backend:<8} decode {decode:>10.0f}/s  encode {encode:>10.0f}/s")
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--number", action="store", type=int, default=20000)
+    op.add_option("--clients", action="store", type=int, default=1000)
+    (opts, args) = op.parse_args()
+    main(opts.number, opts.clients)
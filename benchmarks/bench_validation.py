@@ -0,0 +1,95 @@
+"""Microbenchmark of request validation in method_handler.
+
+Runs method_handler over valid and invalid payloads against an in-memory store
+and prints requests per second for each case.
+
+Usage: python -m benchmarks.bench_validation [-n 20000]
+"""
+import datetime
+import hashlib
+import logging
+import time
+from optparse import OptionParser
+
+import api
+
+
+class DictStore:
+    def __init__(self):
+        self.data = {}
+
+    def cache_get(self, key):
+        return self.data.get(key)
+
+    def cache_set(self, key, score, ttl):
+        self.data[key] = score
+
+    def get(self, cid, date=None):
+        return ["cars", "pets"]
+
+    def get_many(self, cids, date=None):
+        return {cid: self.get(cid, date) for cid in dict.fromkeys(cids)}
+
+
+def with_auth(request):
+    if request["login"] == api.ADMIN_LOGIN:
+        msg = datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT
+    else:
+        msg = request.get("account", "") + request["login"] + api.SALT
+    request["token"] = hashlib.sha512(msg.encode()).hexdigest()
+    return request
+
+
+def method_request(method, arguments):
+    return with_auth({"account": "horns&hoofs", "login": "h&f", "method": method, "arguments": arguments})
+
+
+CASES = {
+    "online_score valid": method_request("online_score", {
+        "phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "01.01.2000",
+        "first_name": "a", "last_name": "b"}),
+    "online_score partial": method_request("online_score", {"phone": "79175002040", "email": "stupnikov@otus.ru"}),
+    "online_score invalid": method_request("online_score", {
+        "phone": "89175002040", "email": "stupnikovotus.ru", "first_name": "a", "last_name": 2}),
+    "clients_interests valid": method_request("clients_interests", {"client_ids": [1, 2, 3], "date": "20.07.2017"}),
+    "clients_interests invalid": method_request("clients_interests", {"client_ids": ["1", "2"], "date": "XXX"}),
+    "bad auth": {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}},
+}
+# the response code of every case, a benchmark of a broken path is not timed
+CODES = {
+    "online_score valid": api.OK,
+    "online_score partial": api.OK,
+    "online_score invalid": api.INVALID_REQUEST,
+    "clients_interests valid": api.OK,
+    "clients_interests invalid": api.INVALID_REQUEST,
+    "bad auth": api.FORBIDDEN,
+}
+
+
+def check(name, store):
+    _, code = api.method_handler({"body": CASES[name], "headers": {}}, {}, store)
+    if code != CODES[name]:
+        raise RuntimeError(f"{name}: response code {code}, expected {CODES[name]}")
+
+
+def bench(body, store, number):
+    request = {"body": body, "headers": {}}
+    started = time.perf_counter()
+    for _ in range(number):
+        api.method_handler(request, {}, store)
+    return number / (time.perf_counter() - started)
+
+
+def main(number):
+    logging.disable(logging.CRITICAL)
+    store = DictStore()
+    for name, body in CASES.items():
+        check(name, store)
+        print(f"{name:<28}{bench(body, store, number):>12.0f} req/s")
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--number", action="store", type=int, default=20000)
+    (opts, args) = op.parse_args()
+    main(opts.number)
@@ -0,0 +1,87 @@
+"""Machine-readable results of the benchmark suite and comparison of two runs.
+
+A result is one JSON object per line:
+
+    {"benchmark": "micro", "name": "get_score hit", "ops": 20000, "ops_per_sec": 51234.5,
+     "p50_us": 18.1, "p99_us": 40.3, "commit": "1a2b3c4"}
+
+Runs saved with --format json --output FILE are compared with
+
+Usage: python -m benchmarks.report before.jsonl after.jsonl
+"""
+import json
+import subprocess
+import sys
+from optparse import OptionParser
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of already sorted `values`."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(benchmark, name, latencies, elapsed, **extra):
+    """Build a result from per operation latencies and the wall time of the run, both in seconds."""
+    values = sorted(latencies)
+    return {
+        "benchmark": benchmark,
+        "name": name,
+        "ops": len(values),
+        "ops_per_sec": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "p50_us": round(percentile(values, 0.5) * 1e6, 2),
+        "p99_us": round(percentile(values, 0.99) * 1e6, 2),
+        **extra,
+    }
+
+
+def write_results(results, fmt="table", output=None):
+    """Print the results as a table, or append them as JSON lines to `output` (stdout by default)."""
+    if fmt == "table":
+        for result in results:
+            print(f"{result['name']:<32}{result['ops_per_sec']:>12.0f} ops/s"
+                  f"  p50 {result['p50_us']:>10.1f} us  p99 {result['p99_us']:>10.1f} us")
+        return
+    commit = current_commit()
+    target = open(output, "a") if output else sys.stdout
+    try:
+        for result in results:
+            target.write(json.dumps(dict(result, commit=commit)) + "\n")
+    finally:
+        if output:
+            target.close()
+
+
+def read_results(path):
+    with open(path) as f:
+        return {(result["benchmark"], result["name"]): result for result in map(json.loads, filter(str.strip, f))}
+
+
+def change(before, after):
+    return (after - before) / before * 100 if before else 0.0
+
+
+def compare(before, after):
+    """Yield (name, throughput change %, p99 change %) for the results present in both runs."""
+    for key, result in after.items():
+        if key in before:
+            yield (" ".join(key), change(before[key]["ops_per_sec"], result["ops_per_sec"]),
+                   change(before[key]["p99_us"], result["p99_us"]))
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog before.jsonl after.jsonl")
+    (opts, args) = op.parse_args()
+    if len(args) != 2:
+        op.error("two result files are expected")
+    for name, throughput, p99 in compare(read_results(args[0]), read_results(args[1])):
+        print(f"{name:<40}throughput {throughput:>+8.1f}%  p99 {p99:>+8.1f}%")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Offline scoring of many people at once over columnar input.
+
+`columns` maps the arguments of get_score (phone, email, birthday, gender,
+first_name, last_name) to equally long sequences of the values get_score gets
+after validation: lists or NumPy arrays, birthdays may be datetime64 with NaT
+for a missing date. columns_from_csv and columns_from_arrow convert a CSV dump
+or an Arrow table. A missing field is empty in every row. Scores and uid: keys are the ones
+get_score calculates row by row. With NumPy the presence masks and the scores
+are computed over whole arrays, otherwise over lists.
+"""
+
+import csv
+import datetime
+import hashlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FIELDS = ("phone", "email", "birthday", "gender", "first_name", "last_name")
+
+
+def columns_from_rows(rows):
+    """Columns of (phone, email, birthday, gender, first_name, last_name) rows, the people of get_scores."""
+    columns = {field: [] for field in FIELDS}
+    for field, values in zip(FIELDS, zip(*rows)):
+        columns[field] = list(values)
+    return columns
+
+
+def columns_from_csv(lines):
+    """Columns of a CSV text with a header of FIELDS, birthdays are in the dd.mm.yyyy form of the API."""
+    columns = {field: [] for field in FIELDS}
+    for row in csv.DictReader(lines):
+        for field in FIELDS:
+            value = row.get(field) or None
+            if value is not None and field == "birthday":
+                value = datetime.datetime.strptime(value, "%d.%m.%Y").date()
+            elif value is not None and field == "gender":
+                value = int(value)
+            columns[field].append(value)
+    return columns
+
+
+def columns_from_arrow(table):
+    """Columns of a pyarrow Table with columns named as FIELDS.
+
+    A column without nulls becomes a NumPy array, a date32 one datetime64; a column with nulls becomes a list
+    with None, since NumPy would turn null integers into NaN, which is true.
+    """
+    columns = {}
+    for field in FIELDS:
+        if field in table.column_names:
+            values = table.column(field)
+            columns[field] = values.to_numpy() if numpy is not None and values.null_count == 0 else values.to_pylist()
+    return columns
+
+
+def column_length(columns):
+    lengths = {len(values) for values in columns.values() if values is not None}
+    if len(lengths) > 1:
+        raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+    return lengths.pop() if lengths else 0
+
+
+def column(columns, field, length):
+    values = columns.get(field)
+    return values if values is not None else [None] * length
+
+
+def presence(values):
+    """Mask of the rows whose value is true, as `if value:` of calculate_score."""
+    if numpy is None:
+        return [bool(value) for value in values]
+    if isinstance(values, numpy.ndarray):
+        if values.dtype.kind in "biuf":
+            return values.astype(bool)
+        if values.dtype.kind in "US":
+            return numpy.char.str_len(values) > 0
+        if values.dtype.kind == "M":
+            return ~numpy.isnat(values)
+    return numpy.asarray(values, dtype=object).astype(bool)
+
+
+def score_columns(columns):
+    """Scores of all rows, a NumPy array of floats or a list without NumPy."""
+    length = column_length(columns)
+    phone, email, birthday, gender, first_name, last_name = (presence(column(columns, field, length))
+                                                             for field in FIELDS)
+    if numpy is not None:
+        return 1.5 * phone + 1.5 * email + 1.5 * (birthday & gender) + 0.5 * (first_name & last_name)
+    return [1.5 * p + 1.5 * e + 1.5 * (b and g) + 0.5 * (f and ln)
+            for p, e, b, g, f, ln in zip(phone, email, birthday, gender, first_name, last_name)]
+
+
+def birthday_keys(values):
+    """The YYYYMMDD key parts of birthdays, empty for a missing one. Every distinct date is formatted once."""
+    if numpy is not None and isinstance(values, numpy.ndarray) and values.dtype.kind == "M":
+        days = values.astype("datetime64[D]")
+        return numpy.where(numpy.isnat(days), "", numpy.char.replace(numpy.datetime_as_string(days), "-", "")).tolist()
+    days = {None: ""}
+
+    def day(birthday):
+        try:
+            return days[birthday]
+        except KeyError:
+            text = days[birthday] = birthday.strftime("%Y%m%d") if birthday else ""
+            return text
+
+    return [day(birthday) for birthday in values]
+
+
+def key_columns(columns):
+    """uid: cache keys of all rows."""
+    length = column_length(columns)
+    md5 = hashlib.md5
+    rows = zip(*(column(columns, field, length) for field in ("first_name", "last_name", "phone", "email")),
+               birthday_keys(column(columns, "birthday", length)))
+    return ["uid:" + md5(f"{first_name or ''}{last_name or ''}{phone or ''}{email or ''}{day}".encode())
+            .hexdigest() for first_name, last_name, phone, email, day in rows]
+
+
+def score_bulk(columns):
+    """Return the uid: keys and the scores of all rows."""
+    return key_columns(columns), score_columns(columns)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Process metrics exported in the Prometheus text format.
+
+Counters and histograms live in shards. A thread is bound to one shard on
+its first update and takes only that shard's lock, so concurrent requests
+rarely wait for each other. A scrape merges the shards. Metrics are per
+process: every worker of the fork mode exports its own.
+"""
+
+import bisect
+import itertools
+import threading
+
+# seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SHARDS = 16
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Shard:
+    __slots__ = ("lock", "counters", "histograms")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        # key -> count per bucket, the last bucket is +Inf, then the sum of values
+        self.histograms = {}
+
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS, shards=SHARDS):
+        self.buckets = tuple(buckets)
+        self.shards = [Shard() for _ in range(shards)]
+        self.descriptions = {}
+        self._local = threading.local()
+        self._next_shard = itertools.count()
+
+    def describe(self, name, kind, text):
+        self.descriptions[name] = (kind, text)
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self.shards[next(self._next_shard) % len(self.shards)]
+            return shard
+
+    def inc(self, name, labels=(), value=1):
+        """Add `value` to a counter, `labels` is a tuple of (name, value) pairs."""
+        shard = self.shard()
+        key = (name, labels)
+        with shard.lock:
+            shard.counters[key] = shard.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        """Put `value` into the buckets of a histogram."""
+        shard = self.shard()
+        key = (name, labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with shard.lock:
+            histogram = shard.histograms.get(key)
+            if histogram is None:
+                histogram = shard.histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[bucket] += 1
+            histogram[-1] += value
+
+    def collect(self):
+        """Merge the shards into ({key: value}, {key: [bucket counts..., sum]})."""
+        counters, histograms = {}, {}
+        for shard in self.shards:
+            with shard.lock:
+                shard_counters = list(shard.counters.items())
+                shard_histograms = [(key, list(histogram)) for key, histogram in shard.histograms.items()]
+            for key, value in shard_counters:
+                counters[key] = counters.get(key, 0) + value
+            for key, histogram in shard_histograms:
+                merged = histograms.setdefault(key, [0] * len(histogram))
+                for i, value in enumerate(histogram):
+                    merged[i] += value
+        return counters, histograms
+
+    def counter(self, name, labels=()):
+        return self.collect()[0].get((name, labels), 0)
+
+    def reset(self):
+        for shard in self.shards:
+            with shard.lock:
+                shard.counters.clear()
+                shard.histograms.clear()
+
+    def render(self, gauges=()):
+        """Return the text exposition of all metrics and of `gauges`, a list of (name, help, [(labels, value)])."""
+        counters, histograms = self.collect()
+        families = {}
+        for (name, labels), value in counters.items():
+            families.setdefault(name, []).append((labels, [f"{name}{format_labels(labels)} {format_value(value)}"]))
+        for (name, labels), histogram in histograms.items():
+            samples = []
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), histogram):
+                cumulative += count
+                samples.append(f"{name}_bucket{format_labels(labels + (('le', format_value(bound)),))} {cumulative}")
+            samples.append(f"{name}_sum{format_labels(labels)} {format_value(histogram[-1])}")
+            samples.append(f"{name}_count{format_labels(labels)} {cumulative}")
+            families.setdefault(name, []).append((labels, samples))
+        lines = []
+        for name in sorted(families):
+            kind, text = self.descriptions.get(name, ("untyped", ""))
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+            for _, samples in sorted(families[name], key=lambda family: str(family[0])):
+                lines += samples
+        for name, text, samples in gauges:
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+METRICS = Metrics()
+METRICS.describe("scoring_requests_total", "counter", "Requests by method and response code.")
+METRICS.describe("scoring_request_duration_seconds", "histogram", "Request latency by method.")
+METRICS.describe("scoring_redis_command_duration_seconds", "histogram", "Redis call latency by command.")
+METRICS.describe("scoring_redis_errors_total", "counter", "Failed Redis calls by command.")
+METRICS.describe("scoring_score_cache_total", "counter", "Score cache lookups by result.")
+METRICS.describe("scoring_clients_total", "counter", "Client ids requested by clients_interests.")
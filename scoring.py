@@ -1,7 +1,74 @@
+import asyncio
 import hashlib
+import random
+import threading
 
+# seconds a score is cached, every key gets a random deviation of up to SCORE_TTL_JITTER of it,
+# so that keys written together do not expire together
+SCORE_TTL = 60 * 60
+SCORE_TTL_JITTER = 0.1
 
-def get_score(logging, store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+
+def score_ttl():
+    return round(SCORE_TTL * random.uniform(1 - SCORE_TTL_JITTER, 1 + SCORE_TTL_JITTER))
+
+
+class SingleFlight:
+    """Runs one call per key at a time, concurrent callers with the same key wait for it and share its result."""
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = self.Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines of one event loop."""
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, func, *args):
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(func(*args))
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        # a cancelled caller does not cancel the lookup the others wait for
+        return await asyncio.shield(task)
+
+
+score_flight = SingleFlight()
+async_score_flight = AsyncSingleFlight()
+
+
+def get_score_key(phone, email, birthday=None, first_name=None, last_name=None):
     key_parts = [
         first_name or "",
         last_name or "",
@@ -9,7 +76,30 @@ def get_score(logging, store, phone, email, birthday=None, gender=None, first_na
         email or "",
         birthday.strftime("%Y%m%d") if birthday is not None else "",
     ]
-    key = "uid:" + hashlib.md5("".join(key_parts).encode()).hexdigest()
+    return "uid:" + hashlib.md5("".join(key_parts).encode()).hexdigest()
+
+
+def calculate_score(phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    score = 0
+    if phone:
+        score += 1.5
+    if email:
+        score += 1.5
+    if birthday and gender:
+        score += 1.5
+    if first_name and last_name:
+        score += 0.5
+    return score
+
+
+def get_score(logging, store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    """Score of a person, concurrent lookups of the same person share one cache read and write."""
+    key = get_score_key(phone, email, birthday, first_name, last_name)
+    return score_flight.do((id(store), key), load_score, logging, store, key,
+                           phone, email, birthday, gender, first_name, last_name)
+
+
+def load_score(logging, store, key, phone, email, birthday, gender, first_name, last_name):
     # try get from cache,
     # fallback to heavy calculation in case of cache miss
     try:
@@ -19,26 +109,93 @@ def get_score(logging, store, phone, email, birthday=None, gender=None, first_na
     if score:
         logging.info('Data found in cache')
         return float(score)
-    if phone:
-        score += 1.5
-    if email:
-        score += 1.5
-    if birthday and gender:
-        score += 1.5
-    if first_name and last_name:
-        score += 0.5
-    # cache for 60 minutes
+    score = calculate_score(phone, email, birthday, gender, first_name, last_name)
+    # cache for about 60 minutes
+    try:
+        store.cache_set(key, score, score_ttl())
+    except Exception:
+        pass
+    return score
+
+
+def get_scores(logging, store, people):
+    """Batch version of get_score with one cache read and one cache write for everybody.
+
+    `people` are (phone, email, birthday, gender, first_name, last_name) tuples.
+    """
+    keys = [get_score_key(phone, email, birthday, first_name, last_name)
+            for phone, email, birthday, gender, first_name, last_name in people]
+    try:
+        cached = store.cache_get_many(keys)
+    except Exception:
+        cached = [None] * len(keys)
+    scores, missed = [], {}
+    for key, person, score in zip(keys, people, cached):
+        if score:
+            scores.append(float(score))
+            continue
+        score = calculate_score(*person)
+        scores.append(score)
+        missed[key] = score
+    logging.info(f'{len(keys) - len(missed)} of {len(keys)} scores found in cache')
+    if missed:
+        try:
+            store.cache_set_many(missed, score_ttl)
+        except Exception:
+            pass
+    return scores
+
+
+async def get_score_async(logging, store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    key = get_score_key(phone, email, birthday, first_name, last_name)
+    return await async_score_flight.do((id(store), key), load_score_async, logging, store, key,
+                                       phone, email, birthday, gender, first_name, last_name)
+
+
+async def load_score_async(logging, store, key, phone, email, birthday, gender, first_name, last_name):
+    try:
+        score = await store.cache_get(key) or 0
+    except Exception:
+        score = 0
+    if score:
+        logging.info('Data found in cache')
+        return float(score)
+    score = calculate_score(phone, email, birthday, gender, first_name, last_name)
     try:
-        store.cache_set(key, score, 60 * 60)
+        await store.cache_set(key, score, score_ttl())
     except Exception:
         pass
     return score
 
 
-def get_interests(logging, store, cid):
+def get_interests(logging, store, cid, date=None):
     try:
-        r = store.get(cid)
+        r = store.get(cid, date)
     except Exception:
         logging.info('DB connection issue, request is rejected')
         raise ConnectionError
     return r if r else []
+
+
+def get_interests_many(logging, store, cids, date=None):
+    try:
+        r = store.get_many(cids, date)
+    except ConnectionError:
+        logging.info('DB connection issue, request is rejected')
+        raise
+    except Exception:
+        logging.info('DB connection issue, request is rejected')
+        raise ConnectionError
+    return {cid: interests if interests else [] for cid, interests in r.items()}
+
+
+async def get_interests_many_async(logging, store, cids, date=None):
+    try:
+        r = await store.get_many(cids, date)
+    except ConnectionError:
+        logging.info('DB connection issue, request is rejected')
+        raise
+    except Exception:
+        logging.info('DB connection issue, request is rejected')
+        raise ConnectionError
+    return {cid: interests if interests else [] for cid, interests in r.items()}
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""JSON encoding of requests and responses.
+
+orjson is used when it is installed, otherwise the standard json module.
+JSON_BACKEND=json|orjson selects a backend explicitly. Both backends encode to
+and decode from bytes, so the servers write the result to the socket as is.
+"""
+
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(obj):
+    return json.dumps(obj).encode()
+
+
+def json_loads(data):
+    return json.loads(data)
+
+
+BACKENDS = {
+    "json": (json_dumps, json_loads),
+}
+
+if orjson is not None:
+    def orjson_dumps(obj):
+        # client ids are int keys of the clients_interests response
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    BACKENDS["orjson"] = (orjson_dumps, orjson.loads)
+
+BACKEND = os.environ.get("JSON_BACKEND") or ("orjson" if orjson is not None else "json")
+if BACKEND not in BACKENDS:
+    raise ValueError(f"JSON backend {BACKEND} is not available")
+
+dumps, loads = BACKENDS[BACKEND]
@@ -0,0 +1,799 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Storage of the score cache and the client interests.
+
+Store keeps both in Redis, behind a per process connection pool, an
+optional local cache of scores and a circuit breaker. MemoryStore and
+SQLiteStore are the backends of nodes without Redis. make_store creates
+the one chosen by STORE_BACKEND.
+"""
+
+import abc
+import datetime
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from redis.exceptions import RedisError
+from sortedcontainers import SortedDict
+
+from metrics import METRICS
+from scoring import SCORE_TTL
+
+# the interests of a client are stored as a bit mask of positions in this list, new interests are only appended
+interests_list = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+INTEREST_BITS = {name: bit for bit, name in enumerate(interests_list)}
+# clients per Redis hash, hashes below hash-max-listpack-entries (128) are stored compactly
+INTERESTS_BUCKET_SIZE = 100
+# day number of a query without a date, after every snapshot
+LATEST_DAY = datetime.date.max.toordinal()
+# day number of the interests written without a date once a client has snapshots, before any real date
+BASE_DAY = 0
+# the value of the Redis hash field of a client whose interests are dated snapshots
+HISTORY_MARK = "h"
+
+REDIS_CONFIG = {
+    "host": os.environ.get("REDIS_HOST", "127.0.0.1"),
+    "port": int(os.environ.get("REDIS_PORT", 6379)),
+    # no AUTH unless REDIS_PASSWORD is set
+    "password": os.environ.get("REDIS_PASSWORD") or None,
+    "db": int(os.environ.get("REDIS_DB", 0)),
+    # connection budget of the server, split between pre-forked worker processes
+    "max_connections": int(os.environ.get("REDIS_MAX_CONNECTIONS", 32)),
+    # seconds to wait for a free connection when all of them are in use
+    "pool_timeout": float(os.environ.get("REDIS_POOL_TIMEOUT", 1)),
+    "socket_connect_timeout": float(os.environ.get("REDIS_CONNECT_TIMEOUT", 0.5)),
+    "socket_timeout": float(os.environ.get("REDIS_TIMEOUT", 0.5)),
+    "health_check_interval": int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+    "socket_keepalive": True,
+}
+
+
+class MonitoredConnectionPool(redis.BlockingConnectionPool):
+    """Blocking connection pool which counts waits for a free connection."""
+
+    def reset(self):
+        super().reset()
+        self.waits = 0
+
+    def get_connection(self, command_name, *keys, **options):
+        if self.pool.empty():
+            self.waits += 1
+        return super().get_connection(command_name, *keys, **options)
+
+    def stats(self):
+        created = len(self._connections)
+        idle = sum(1 for connection in list(self.pool.queue) if connection is not None)
+        return {
+            "max_connections": self.max_connections,
+            "created": created,
+            "in_use": created - idle,
+            "waits": self.waits,
+        }
+
+
+LOCAL_CACHE_CONFIG = {
+    # entries kept in process by every worker, 0 disables the local cache
+    "size": int(os.environ.get("LOCAL_CACHE_SIZE", 10000)),
+    # seconds an entry is served from process memory without asking Redis
+    "ttl": float(os.environ.get("LOCAL_CACHE_TTL", 60)),
+}
+
+
+class LocalCache:
+    """Bounded LRU cache with expiring entries, shared by the threads of one process."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > time.monotonic():
+                    self.data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def stats(self):
+        return {"size": len(self.data), "hits": self.hits, "misses": self.misses}
+
+
+def make_local_cache(config=LOCAL_CACHE_CONFIG):
+    if config["size"] <= 0:
+        return None
+    return LocalCache(config["size"], config["ttl"])
+
+
+BREAKER_CONFIG = {
+    # consecutive Redis failures which open the circuit
+    "threshold": int(os.environ.get("REDIS_BREAKER_THRESHOLD", 5)),
+    # seconds the circuit stays open before a probe call is let through
+    "reset_timeout": float(os.environ.get("REDIS_BREAKER_RESET_TIMEOUT", 5)),
+}
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+# errors meaning Redis could not be reached, any other RedisError is an answer from the server
+CONNECTIVITY_ERRORS = (redis.ConnectionError, redis.TimeoutError)
+
+
+class CircuitBreaker:
+    """Stops calling Redis after `threshold` consecutive failures.
+
+    While the circuit is open calls fail at once with CircuitOpenError. After `reset_timeout`
+    seconds one probe call is let through (half-open), its result closes or reopens the circuit.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        if self.state == self.CLOSED:
+            return
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return
+            if self.state != self.CLOSED:
+                raise CircuitOpenError("Redis circuit breaker is open")
+
+    def success(self):
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self.lock:
+            if self.state != self.CLOSED:
+                logging.info("Redis circuit breaker is closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                logging.info(f"Redis circuit breaker is open after {self.failures} failure(s)")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+
+    def abort(self):
+        # The probe ended without an answer either way (e.g. it was cancelled): let a later call probe again
+        if self.state != self.HALF_OPEN:
+            return
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except CONNECTIVITY_ERRORS:
+            self.failure()
+            raise
+        except Exception:
+            # Redis has answered, the error is not a connectivity issue
+            self.success()
+            raise
+        else:
+            self.success()
+        finally:
+            self.abort()
+        return result
+
+    async def call_async(self, func, *args, **kwargs):
+        self.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except CONNECTIVITY_ERRORS:
+            self.failure()
+            raise
+        except Exception:
+            self.success()
+            raise
+        else:
+            self.success()
+        finally:
+            self.abort()
+        return result
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "trips": self.trips}
+
+
+def make_breaker(config=BREAKER_CONFIG):
+    if config["threshold"] <= 0:
+        return None
+    return CircuitBreaker(config["threshold"], config["reset_timeout"])
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# worker processes sharing the connection budget of REDIS_CONFIG, set by configure_redis
+_redis_workers = 1
+
+
+def configure_redis(workers=1, **options):
+    """Update REDIS_CONFIG and set the number of worker processes sharing its connection budget.
+
+    Called before the pool is created, calling it again does not shrink the budget further.
+    """
+    global _redis_workers
+    REDIS_CONFIG.update(options)
+    _redis_workers = workers
+
+
+def pool_size():
+    """Connections of the pool of one process, REDIS_CONFIG["max_connections"] is split between the workers."""
+    return max(1, REDIS_CONFIG["max_connections"] // _redis_workers)
+
+
+def get_connection_pool():
+    """Return the process wide pool, it is created on the first use and not at import time."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = dict(REDIS_CONFIG)
+                del config["max_connections"]
+                _pool = MonitoredConnectionPool(
+                    max_connections=pool_size(),
+                    timeout=config.pop("pool_timeout"),
+                    encoding="utf-8",
+                    decode_responses=True,
+                    **config)
+    return _pool
+
+
+def count_cache_lookups(hits, lookups):
+    if hits:
+        METRICS.inc("scoring_score_cache_total", (("result", "hit"),), hits)
+    if lookups > hits:
+        METRICS.inc("scoring_score_cache_total", (("result", "miss"),), lookups - hits)
+
+
+def encode_interests(names):
+    """Bit mask of interest names, ValueError for a name which is not in interests_list."""
+    mask = 0
+    for name in names:
+        try:
+            mask |= 1 << INTEREST_BITS[name]
+        except (KeyError, TypeError):
+            raise ValueError(f"Unknown interest: {name!r}") from None
+    return mask
+
+
+@functools.lru_cache(maxsize=4096)
+def interest_names(mask):
+    return tuple(name for bit, name in enumerate(interests_list) if mask >> bit & 1)
+
+
+def decode_interests(mask):
+    """Interest names of a bit mask, the mask may be the int or the text Redis returns. Empty for None."""
+    return list(interest_names(int(mask))) if mask else []
+
+
+def interests_key(cid):
+    """Redis hash and field of a client, every hash keeps the masks of INTERESTS_BUCKET_SIZE consecutive ids."""
+    bucket, field = divmod(cid, INTERESTS_BUCKET_SIZE)
+    return f"interests:{bucket}", field
+
+
+def interests_buckets(cids):
+    """Group client ids by their Redis hash: {key: ([cid, ...], [field, ...])}."""
+    buckets = {}
+    for cid in dict.fromkeys(cids):
+        key, field = interests_key(cid)
+        bucket = buckets.setdefault(key, ([], []))
+        bucket[0].append(cid)
+        bucket[1].append(field)
+    return buckets
+
+
+def interests_history_key(cid):
+    """Redis sorted set of the dated snapshots of a client, scored by the day number, members are "day:mask"."""
+    return f"interests:history:{cid}"
+
+
+def snapshot_day(date):
+    return date.toordinal() if date is not None else LATEST_DAY
+
+
+def snapshot_mask(member):
+    if isinstance(member, bytes):
+        member = member.decode()
+    return int(member.partition(":")[2])
+
+
+def interests_mappings(items, mark=False):
+    """HSET mappings per Redis hash of {cid: interest names}, with `mark` the history mark of every client."""
+    mappings = {}
+    for cid, names in items.items():
+        key, field = interests_key(cid)
+        mappings.setdefault(key, {})[field] = HISTORY_MARK if mark else encode_interests(names)
+    return mappings
+
+
+def queue_interests_writes(pipe, items, date=None, current=None):
+    """Queue the writes of set_interests_many on a Redis pipeline, sync or asyncio.
+
+    Interests without a date replace the snapshots of the clients. A snapshot puts the history mark in the hash,
+    `current` are the hash values of the clients read before it (masks_from_replies): a mask written without
+    a date moves to the history as the BASE_DAY snapshot and stays in force until the first dated one.
+    """
+    if date is None:
+        mappings = interests_mappings(items)
+        if items:
+            pipe.delete(*map(interests_history_key, items))
+    else:
+        day = date.toordinal()
+        current = current or {}
+        for cid, mask in {cid: encode_interests(names) for cid, names in items.items()}.items():
+            key = interests_history_key(cid)
+            base = current.get(cid)
+            if base is not None and base not in (HISTORY_MARK, HISTORY_MARK.encode()):
+                pipe.zadd(key, {f"{BASE_DAY}:{int(base)}": BASE_DAY})
+            # one snapshot per day, a new one replaces it
+            pipe.zremrangebyscore(key, day, day)
+            pipe.zadd(key, {f"{day}:{mask}": day})
+        mappings = interests_mappings(items, mark=True)
+    for key, mapping in mappings.items():
+        pipe.hset(key, mapping=mapping)
+
+
+def queue_interests_reads(pipe, buckets):
+    for key, (_, fields) in buckets.items():
+        pipe.hmget(key, fields)
+
+
+def masks_from_replies(buckets, results):
+    """Hash values per client from the HMGET replies, the clients of a failed reply are left out."""
+    masks = {}
+    for (cids, _), replies in zip(buckets.values(), results):
+        if not isinstance(replies, Exception):
+            masks.update(zip(cids, replies))
+    return masks
+
+
+def history_cids(masks):
+    return [cid for cid, mask in masks.items() if mask in (HISTORY_MARK, HISTORY_MARK.encode())]
+
+
+def queue_snapshot_reads(pipe, cids, date=None):
+    """Queue the lookups of the snapshot of every client at `date`, the last one on or before the day,
+    found in O(log n) by ZREVRANGEBYSCORE ... LIMIT 0 1."""
+    day = snapshot_day(date)
+    for cid in cids:
+        pipe.zrevrangebyscore(interests_history_key(cid), day, "-inf", start=0, num=1)
+
+
+def interests_from_masks(masks, snapshots):
+    """Interests per client, `snapshots` are the ZREVRANGEBYSCORE replies of the clients with a history.
+
+    A client with a failed snapshot lookup is left out, one with no snapshot up to the date has no interests.
+    """
+    interests = {}
+    for cid, mask in masks.items():
+        if cid not in snapshots:
+            interests[cid] = decode_interests(mask)
+        elif not isinstance(snapshots[cid], Exception):
+            snapshot = snapshots[cid]
+            interests[cid] = decode_interests(snapshot_mask(snapshot[0]) if snapshot else None)
+    return interests
+
+
+class BaseStore(abc.ABC):
+    """Score cache and client interests, the storage interface of the handlers.
+
+    Backends implement the abstract methods cache_get, cache_set, get, set_interests_many and warmup.
+    The bulk variants call them key by key unless a backend has a faster way.
+    A client without stored interests has none, get returns an empty list.
+
+    Interests written with a date are a snapshot valid from that day until the next one. A lookup with a date
+    returns the snapshot of that day, without a date the latest one. Interests written without a date replace
+    the snapshots of a client and hold for every date, after a snapshot they still hold for the dates before it.
+    """
+
+    @abc.abstractmethod
+    def cache_get(self, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def cache_set(self, key, score, ttl):
+        raise NotImplementedError
+
+    def cache_get_many(self, keys):
+        return [self.cache_get(key) for key in keys]
+
+    def cache_set_many(self, items, ttl):
+        """Write several cache keys, `ttl` is seconds or a function returning the seconds for every key."""
+        for key, score in items.items():
+            self.cache_set(key, score, ttl() if callable(ttl) else ttl)
+
+    @abc.abstractmethod
+    def get(self, cid, date=None):
+        raise NotImplementedError
+
+    def get_many(self, cids, date=None):
+        return {cid: self.get(cid, date) for cid in dict.fromkeys(cids)}
+
+    def set_interests(self, cid, names, date=None):
+        self.set_interests_many({cid: names}, date)
+
+    @abc.abstractmethod
+    def set_interests_many(self, items, date=None):
+        """Replace the interests of clients, `items` is {cid: interest names}, `date` the day of a snapshot."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def warmup(self):
+        """Prepare the backend at startup, False if it is not available."""
+        raise NotImplementedError
+
+    def cache_stats(self):
+        return {}
+
+    def breaker_stats(self):
+        return {}
+
+
+class Store(BaseStore):
+    """Redis backend, the shared store of all servers."""
+
+    def __init__(self, redis=None, local_cache=None, breaker=None):
+        self._redis = redis
+        self.local_cache = local_cache
+        self.breaker = breaker
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = redis.StrictRedis(connection_pool=get_connection_pool())
+        return self._redis
+
+    def call(self, func, *args, **kwargs):
+        labels = (("command", getattr(func, "__name__", "unknown")),)
+        started = time.perf_counter()
+        try:
+            if self.breaker is None:
+                return func(*args, **kwargs)
+            return self.breaker.call(func, *args, **kwargs)
+        except Exception:
+            METRICS.inc("scoring_redis_errors_total", labels)
+            raise
+        finally:
+            METRICS.observe("scoring_redis_command_duration_seconds", time.perf_counter() - started, labels)
+
+    def pool_stats(self):
+        pool = getattr(self.redis, "connection_pool", None)
+        return pool.stats() if hasattr(pool, "stats") else {}
+
+    def cache_stats(self):
+        return self.local_cache.stats() if self.local_cache is not None else {}
+
+    def breaker_stats(self):
+        return self.breaker.stats() if self.breaker is not None else {}
+
+    def cache_get(self, key):
+        result = self.local_cache.get(key) if self.local_cache is not None else None
+        if result is None:
+            result = self.call(self.redis.get, key)
+            if result is not None and self.local_cache is not None:
+                self.local_cache.set(key, result)
+        count_cache_lookups(1 if result is not None else 0, 1)
+        return result
+
+    def cache_set(self, key, score, ttl):
+        self.call(self.redis.set, key, score, ttl)
+        if self.local_cache is not None:
+            # kept as text, the way Redis returns it: a cached score of 0 must not read as a miss
+            self.local_cache.set(key, str(score), ttl)
+
+    def cache_get_many(self, keys):
+        """Read several cache keys with one MGET, keys found in the local cache are not requested."""
+        result = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            if self.local_cache is not None:
+                result[i] = self.local_cache.get(key)
+            if result[i] is None:
+                missing.append(i)
+        if missing:
+            values = self.call(self.redis.mget, [keys[i] for i in missing])
+            for i, value in zip(missing, values):
+                result[i] = value
+                if value is not None and self.local_cache is not None:
+                    self.local_cache.set(keys[i], value)
+        count_cache_lookups(sum(1 for value in result if value is not None), len(keys))
+        return result
+
+    def cache_set_many(self, items, ttl):
+        """Write several cache keys with one pipelined round trip.
+
+        `ttl` is seconds or a function returning the seconds for every key.
+        """
+        ttls = {key: ttl() if callable(ttl) else ttl for key in items}
+        pipe = self.redis.pipeline(transaction=False)
+        for key, score in items.items():
+            pipe.set(key, score, ttls[key])
+        self.call(pipe.execute)
+        if self.local_cache is not None:
+            for key, score in items.items():
+                self.local_cache.set(key, str(score), ttls[key])
+
+    def set_interests_many(self, items, date=None):
+        current = None
+        if date is not None:
+            # the interests written without a date become the base of the history
+            buckets = interests_buckets(items)
+            pipe = self.redis.pipeline(transaction=False)
+            queue_interests_reads(pipe, buckets)
+            current = masks_from_replies(buckets, self.call(pipe.execute))
+        pipe = self.redis.pipeline(transaction=False)
+        queue_interests_writes(pipe, items, date, current)
+        self.call(pipe.execute)
+
+    def warmup(self):
+        """Check that Redis answers. Runs once at startup, the interests are written by the loader."""
+        try:
+            return bool(self.call(self.redis.ping))
+        except (RedisError, CircuitOpenError) as e:
+            logging.exception(f'redis exception {e}')
+            return False
+
+    def get(self, cid, date=None):
+        return self.read_interests([cid], date, raise_on_error=True)[cid]
+
+    def get_many(self, cids, date=None):
+        """Fetch interests of several clients in one pipelined round trip, a second one for clients with snapshots.
+
+        Clients whose lookup failed are left out of the result, so the caller can retry only them.
+        """
+        return self.read_interests(cids, date, raise_on_error=False)
+
+    def read_interests(self, cids, date, raise_on_error):
+        buckets = interests_buckets(cids)
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            queue_interests_reads(pipe, buckets)
+            masks = masks_from_replies(buckets, self.call(pipe.execute, raise_on_error=raise_on_error))
+            snapshots = {}
+            history = history_cids(masks)
+            if history:
+                pipe = self.redis.pipeline(transaction=False)
+                queue_snapshot_reads(pipe, history, date)
+                snapshots = dict(zip(history, self.call(pipe.execute, raise_on_error=raise_on_error)))
+        except RedisError as e:
+            logging.exception(f'redis exception {e}')
+            raise
+        return interests_from_masks(masks, snapshots)
+
+
+class MemoryStore(BaseStore):
+    """Store in the memory of the process: scores in a bounded LRU with expiry, interest masks in a dict,
+    the snapshots of a client in a SortedDict by the day number.
+
+    Lookups take microseconds, but every worker process of the fork mode has its own data.
+    """
+
+    def __init__(self, size):
+        self.scores = LocalCache(size, SCORE_TTL)
+        self.interests = {}
+        self.history = {}
+
+    def cache_get(self, key):
+        result = self.scores.get(key)
+        count_cache_lookups(1 if result is not None else 0, 1)
+        return result
+
+    def cache_set(self, key, score, ttl):
+        # kept as text, the way Redis returns it
+        self.scores.set(key, str(score), ttl)
+
+    def cache_stats(self):
+        return self.scores.stats()
+
+    def set_interests_many(self, items, date=None):
+        masks = {cid: encode_interests(names) for cid, names in items.items()}
+        if date is None:
+            self.interests.update(masks)
+            for cid in masks:
+                self.history.pop(cid, None)
+            return
+        day = date.toordinal()
+        for cid, mask in masks.items():
+            self.history.setdefault(cid, SortedDict())[day] = mask
+
+    def warmup(self):
+        return True
+
+    def get(self, cid, date=None):
+        history = self.history.get(cid)
+        if history is None:
+            return decode_interests(self.interests.get(cid))
+        i = history.bisect_right(snapshot_day(date))
+        # before the first snapshot the interests written without a date hold
+        return decode_interests(history.peekitem(i - 1)[1] if i else self.interests.get(cid))
+
+
+class SQLiteStore(BaseStore):
+    """Store in a local SQLite file, shared by the processes of a node and kept over restarts.
+
+    Every thread and every forked process opens its own connection. The database is in WAL mode,
+    so lookups do not wait for a writer.
+    """
+    # bound parameters of one statement, below the SQLite limit
+    batch_size = 500
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self.create_schema()
+
+    @property
+    def db(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.db = self.connect()
+            local.pid = os.getpid()
+        return local.db
+
+    def connect(self):
+        """Open the connection of a thread, the schema and the journal mode are set once by create_schema."""
+        db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        # a setting of the connection, not of the file
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def create_schema(self):
+        """Create the tables and switch the file to WAL, both are kept in the database file."""
+        db = self.connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+                       " WITHOUT ROWID")
+            # the client id is the rowid, a row is a few bytes
+            db.execute("CREATE TABLE IF NOT EXISTS client_interests (cid INTEGER PRIMARY KEY, mask INTEGER NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS interests_history (cid INTEGER NOT NULL, day INTEGER NOT NULL,"
+                       " mask INTEGER NOT NULL, PRIMARY KEY (cid, day)) WITHOUT ROWID")
+        finally:
+            db.close()
+
+    def write(self, sql, rows):
+        """Run `sql` for all `rows` in one transaction."""
+        db = self.db
+        db.execute("BEGIN")
+        try:
+            db.executemany(sql, rows)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def cache_get(self, key):
+        row = self.db.execute("SELECT value FROM scores WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        count_cache_lookups(1 if row else 0, 1)
+        return row[0] if row else None
+
+    def cache_set(self, key, score, ttl):
+        self.db.execute("INSERT OR REPLACE INTO scores VALUES (?, ?, ?)", (key, str(score), time.time() + ttl))
+
+    def cache_get_many(self, keys):
+        """Read several cache keys with one query per `batch_size` keys."""
+        found = {}
+        now = time.time()
+        unique = list(dict.fromkeys(keys))
+        for i in range(0, len(unique), self.batch_size):
+            batch = unique[i:i + self.batch_size]
+            found.update(self.db.execute(
+                f"SELECT key, value FROM scores WHERE expires > ? AND key IN ({','.join('?' * len(batch))})",
+                [now] + batch))
+        result = [found.get(key) for key in keys]
+        count_cache_lookups(sum(1 for value in result if value is not None), len(keys))
+        return result
+
+    def cache_set_many(self, items, ttl):
+        """Write several cache keys in one transaction."""
+        now = time.time()
+        self.write("INSERT OR REPLACE INTO scores VALUES (?, ?, ?)",
+                   [(key, str(score), now + (ttl() if callable(ttl) else ttl)) for key, score in items.items()])
+
+    def set_interests_many(self, items, date=None):
+        if date is None:
+            rows = [(cid, encode_interests(names)) for cid, names in items.items()]
+            self.write("DELETE FROM interests_history WHERE cid = ?", [(cid,) for cid, _ in rows])
+            self.write("INSERT OR REPLACE INTO client_interests VALUES (?, ?)", rows)
+        else:
+            self.write("INSERT OR REPLACE INTO interests_history VALUES (?, ?, ?)",
+                       [(cid, date.toordinal(), encode_interests(names)) for cid, names in items.items()])
+
+    def warmup(self):
+        """Drop the expired scores, False if the database can not be opened."""
+        try:
+            self.db.execute("DELETE FROM scores WHERE expires <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logging.exception(f'sqlite exception {e}')
+            return False
+        return True
+
+    def get(self, cid, date=None):
+        return self.get_many([cid], date)[cid]
+
+    def get_many(self, cids, date=None):
+        """Fetch interests of several clients with one query per `batch_size` ids.
+
+        The snapshot of a client is found by a seek in the (cid, day) primary key, before the first one
+        the interests written without a date hold.
+        """
+        unique = list(dict.fromkeys(cids))
+        day = snapshot_day(date)
+        masks = {}
+        for i in range(0, len(unique), self.batch_size):
+            batch = unique[i:i + self.batch_size]
+            rows = self.db.execute(
+                f"WITH ids(cid) AS (VALUES {','.join(['(?)'] * len(batch))}) SELECT ids.cid, COALESCE("
+                " (SELECT mask FROM interests_history WHERE cid = ids.cid AND day <= ? ORDER BY day DESC LIMIT 1),"
+                " (SELECT mask FROM client_interests WHERE cid = ids.cid))"
+                " FROM ids", batch + [day])
+            masks.update(rows)
+        return {cid: decode_interests(masks.get(cid)) for cid in unique}
+
+
+STORE_CONFIG = {
+    # redis, memory (in the process) or sqlite (a local file)
+    "backend": os.environ.get("STORE_BACKEND", "redis"),
+    "path": os.environ.get("STORE_PATH", "scoring.db"),
+    # scores kept by the memory backend
+    "size": int(os.environ.get("STORE_MEMORY_SIZE", 1000000)),
+    # interests loaded into the memory backend when the server starts, CSV or JSONL
+    "interests_file": os.environ.get("STORE_INTERESTS_FILE") or None,
+}
+
+
+def make_store(config=STORE_CONFIG, local_cache=None):
+    """Create the store of the configured backend, `local_cache` is put in front of Redis only."""
+    backend = config["backend"]
+    if backend == "redis":
+        return Store(local_cache=local_cache, breaker=make_breaker())
+    if backend == "memory":
+        return MemoryStore(config["size"])
+    if backend == "sqlite":
+        return SQLiteStore(config["path"])
+    raise ValueError(f"Unknown store backend: {backend}")
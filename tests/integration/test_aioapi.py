@@ -0,0 +1,166 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import time
+import unittest
+from unittest import mock
+
+import fakeredis
+import fakeredis.aioredis
+from test_api import TestSuite, cases
+
+import aioapi
+import api
+import serializer
+from store import STORE_CONFIG, MemoryStore, Store
+
+SCORE_ARGUMENTS = [
+    {},
+    {"phone": "79175002040"},
+    {"phone": "79175002040", "email": "stupnikovotus.ru"},
+    {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "01.01.1890"},
+    {"email": "stupnikov@otus.ru", "gender": 1, "last_name": 2},
+    {"phone": "79175002040", "email": "stupnikov@otus.ru"},
+    {"phone": 79175002040, "email": "stupnikov@otus.ru"},
+    {"gender": 1, "birthday": "01.01.2000", "first_name": "a", "last_name": "b"},
+    {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1, "birthday": "01.01.2000",
+     "first_name": "a", "last_name": "b"},
+]
+
+
+class TestAsyncHandler(TestSuite):
+    def setUp(self):
+        super().setUp()
+        self.async_store = aioapi.AsyncStore(fakeredis.aioredis.FakeRedis())
+        self.async_context = {}
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def get_async_response(self, request):
+        return self.loop.run_until_complete(
+            aioapi.method_handler({"body": request, "headers": self.headers}, self.async_context, self.async_store))
+
+    def assert_same_context(self):
+        timing, async_timing = self.context.pop("timing"), self.async_context.pop("timing")
+        self.assertEqual(self.context, self.async_context)
+        self.assertEqual(timing.keys(), async_timing.keys())
+
+    @cases(SCORE_ARGUMENTS)
+    def test_score_matches_sync_handler(self, arguments):
+        for login in ("h&f", "admin"):
+            request = {"account": "horns&hoofs", "login": login, "method": "online_score", "arguments": arguments}
+            self.set_valid_auth(request)
+            self.assertEqual(self.get_response(request), self.get_async_response(request), arguments)
+            self.assert_same_context()
+
+    @cases([
+        {},
+        {"client_ids": [], "date": "20.07.2017"},
+        {"client_ids": [1, 2], "date": "XXX"},
+        {"client_ids": [1, 2, 3], "date": "19.07.2017"},
+        {"client_ids": [1, 2, 3], "date": "18.07.2017"},
+        {"client_ids": [0]},
+    ])
+    def test_interests_match_sync_handler(self, arguments):
+        interests = {1: ["cars"], 2: ["pets", "tv"], 3: []}
+        snapshot = {1: ["otus"], 3: ["books"]}
+        self.store.set_interests_many(interests)
+        self.store.set_interests_many(snapshot, datetime.date(2017, 7, 19))
+        self.loop.run_until_complete(self.async_store.set_interests_many(interests))
+        self.loop.run_until_complete(self.async_store.set_interests_many(snapshot, datetime.date(2017, 7, 19)))
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        self.set_valid_auth(request)
+        self.assertEqual(self.get_response(request), self.get_async_response(request), arguments)
+        self.assert_same_context()
+
+    def test_interests_db_is_down(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}}
+        self.set_valid_auth(request)
+        self.async_store = aioapi.AsyncStore(mock.Mock())
+        _, code = self.get_async_response(request)
+        self.assertEqual(api.INTERNAL_ERROR, code)
+
+    def test_local_store(self):
+        self.store = MemoryStore(100)
+        self.async_store = aioapi.LocalAsyncStore(MemoryStore(100))
+        self.store.warmup()
+        self.loop.run_until_complete(self.async_store.warmup())
+        self.test_score_matches_sync_handler()
+        self.test_interests_match_sync_handler()
+        self.assertIsInstance(aioapi.make_store(dict(STORE_CONFIG, backend="memory")), aioapi.LocalAsyncStore)
+
+
+class TestAsyncHTTPServer(unittest.TestCase):
+    def setUp(self):
+        self.store = aioapi.AsyncStore(fakeredis.aioredis.FakeRedis())
+        self.server = aioapi.AsyncHTTPServer(self.store)
+
+    async def exchange(self, bodies):
+        server = await asyncio.start_server(self.server.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        responses = []
+        for body in bodies:
+            writer.write(b"POST /method HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+            status = await reader.readline()
+            headers = {}
+            while (line := await reader.readline()) != b"\r\n":
+                name, _, value = line.decode().partition(":")
+                headers[name] = value.strip()
+            responses.append((status, await reader.readexactly(int(headers["Content-Length"]))))
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return responses
+
+    def test_keep_alive_round_trip(self):
+        token = hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode()).hexdigest()
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": token,
+                   "arguments": {"first_name": "a", "last_name": "b"}}
+        responses = asyncio.run(self.exchange([json.dumps(request).encode(), b"{}"]))
+        expected = api.method_handler({"body": request, "headers": {}}, {}, Store(fakeredis.FakeStrictRedis()))
+        self.assertEqual((b"HTTP/1.1 200 OK\r\n", serializer.dumps(api.build_response(*expected))), responses[0])
+        self.assertEqual((b"HTTP/1.1 422 Unprocessable Entity\r\n", serializer.dumps({"error": "_", "code": 422})),
+                         responses[1])
+
+    async def send(self, data):
+        server = await asyncio.start_server(self.server.handle_connection, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        writer.write(data)
+        try:
+            return await asyncio.wait_for(reader.read(), 5)
+        finally:
+            writer.close()
+            server.close()
+            await server.wait_closed()
+
+    def test_partial_request_times_out(self):
+        with mock.patch("api.KEEP_ALIVE_TIMEOUT", 0.2):
+            for data in (b"POST /method HTTP/1.1\r\nContent-Len", b"POST /method HTTP/1.1\r\nContent-Length: 10\r\n\r\n{}"):
+                started = time.perf_counter()
+                self.assertEqual(b"", asyncio.run(self.send(data)))
+                self.assertLess(time.perf_counter() - started, 2)
+
+    @cases([
+        (b"Transfer-Encoding: chunked\r\n", b"411 Length Required"),
+        (b"Transfer-Encoding: chunked\r\nContent-Length: 4\r\n", b"411 Length Required"),
+        (b"Content-Length: -1\r\n", b"400 Bad Request"),
+        (b"Content-Length: x\r\n", b"400 Bad Request"),
+        (b"Content-Length: 4\r\nContent-Length: 2\r\n", b"400 Bad Request"),
+    ])
+    def test_body_without_valid_length_closes_connection(self, headers, status):
+        data = b"POST /method HTTP/1.1\r\n%s\r\n2\r\n{}\r\n0\r\n\r\nGET /metrics HTTP/1.1\r\n\r\n" % headers
+        response = asyncio.run(self.send(data))
+        self.assertEqual(b"HTTP/1.1 %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n" % status, response)
+
+    def test_unknown_path(self):
+        response = asyncio.run(self.send(b"GET /other HTTP/1.1\r\nConnection: close\r\n\r\n"))
+        self.assertTrue(response.startswith(b"HTTP/1.1 404 Not Found\r\n"), response)
+        response = asyncio.run(self.send(b"PUT /method HTTP/1.1\r\nConnection: close\r\n\r\n"))
+        self.assertTrue(response.startswith(b"HTTP/1.1 501 Not Implemented\r\n"), response)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,37 @@
+import asyncio
 import datetime
 import functools
 import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
 from unittest import mock
 
 import fakeredis
+import redis
 
 import api
+import scoring
+from store import (
+    REDIS_CONFIG,
+    STORE_CONFIG,
+    BaseStore,
+    CircuitBreaker,
+    LocalCache,
+    MemoryStore,
+    MonitoredConnectionPool,
+    SQLiteStore,
+    Store,
+    configure_redis,
+    decode_interests,
+    encode_interests,
+    make_store,
+    pool_size,
+)
 
 
 def cases(cases):
@@ -20,8 +45,8 @@ def cases(cases):
     return decorator
 
 
-@mock.patch("api.redis")
-class TestStore(api.Store):
+@mock.patch("store.redis")
+class TestStore(Store):
     pass
 
 
@@ -110,6 +135,17 @@ class TestScore(TestSuite):
         self.assertTrue(isinstance(score, (int, float)) and score >= 0, arguments)
         self.assertEqual(sorted(self.context["has"]), sorted(arguments.keys()))
 
+    @cases([
+        ({"account": "horns&hoofs", "login": "h&f", "arguments": {"phone": "79175002040"}}, api.BAD_REQUEST),
+        ({"account": "horns&hoofs", "login": "h&f", "method": None, "arguments": {"a": 1}}, api.INVALID_REQUEST),
+        ({"account": "horns&hoofs", "login": "h&f", "method": "unknown", "arguments": {"a": 1}}, api.INVALID_REQUEST),
+        ({"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": [1]}, api.INVALID_REQUEST),
+    ])
+    def test_invalid_method(self, request, expectation):
+        self.set_valid_auth(request)
+        _, code = self.get_response(request)
+        self.assertEqual(expectation, code, request)
+
     def test_ok_score_admin_request(self):
         arguments = {"phone": "79175002040", "email": "stupnikov@otus.ru"}
         request = {"account": "horns&hoofs", "login": "admin", "method": "online_score", "arguments": arguments}
@@ -121,6 +157,12 @@ class TestScore(TestSuite):
 
 
 class TestInterests(TestSuite):
+    INTERESTS = {0: ["otus"], 1: ["cars", "pets"], 2: ["books"], 3: ["sport", "tv", "geek"]}
+
+    def setUp(self):
+        super().setUp()
+        self.store.set_interests_many(self.INTERESTS)
+
     @cases([
         {},
         {"date": "20.07.2017"},
@@ -149,8 +191,492 @@ class TestInterests(TestSuite):
         self.assertEqual(len(arguments["client_ids"]), len(response))
         self.assertTrue(all(v and isinstance(v, list) and all(isinstance(i, (bytes, str)) for i in v)
                         for v in response.values()))
+        self.assertEqual({cid: self.INTERESTS[cid] for cid in arguments["client_ids"]}, response)
         self.assertEqual(self.context.get("nclients"), len(arguments["client_ids"]))
 
+    def test_unknown_client_has_no_interests(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 1000]}}
+        self.set_valid_auth(request)
+        self.assertEqual(({1: ["cars", "pets"], 1000: []}, api.OK), self.get_response(request))
+
+
+class TestInterestsSnapshots(TestSuite):
+    SNAPSHOTS = [
+        (datetime.date(2017, 7, 20), {1: ["pets"], 3: []}),
+        (datetime.date(2017, 7, 1), {1: ["cars"], 3: ["tv"]}),
+        (datetime.date(2017, 8, 1), {3: ["geek"]}),
+    ]
+    LOOKUPS = [
+        (None, {1: ["pets"], 2: ["books"], 3: ["geek"], 4: []}),
+        (datetime.date(2017, 6, 30), {1: ["otus"], 2: ["books"], 3: [], 4: []}),
+        (datetime.date(2017, 7, 1), {1: ["cars"], 2: ["books"], 3: ["tv"], 4: []}),
+        (datetime.date(2017, 7, 19), {1: ["cars"], 2: ["books"], 3: ["tv"], 4: []}),
+        (datetime.date(2017, 7, 31), {1: ["pets"], 2: ["books"], 3: [], 4: []}),
+    ]
+
+    def fill(self, store):
+        store.set_interests_many({1: ["otus"], 2: ["books"]})
+        for date, items in self.SNAPSHOTS:
+            store.set_interests_many(items, date)
+
+    def assert_lookups(self, store):
+        for date, expected in self.LOOKUPS:
+            self.assertEqual(expected, store.get_many([1, 2, 3, 4], date), date)
+            self.assertEqual(expected[1], store.get(1, date), date)
+        # interests without a date replace the snapshots
+        store.set_interests(3, ["cars"])
+        self.assertEqual(["cars"], store.get(3, datetime.date(2017, 6, 30)))
+        self.assertEqual(["cars"], store.get(3))
+
+    def test_redis(self):
+        self.fill(self.store)
+        self.store.set_interests(1, ["pets"], datetime.date(2017, 7, 20))
+        self.assertEqual([b"0:1024", b"736511:1", b"736530:2"], self.redis.zrange("interests:history:1", 0, -1))
+        self.assertEqual({b"1": b"h", b"2": b"64", b"3": b"h"}, self.redis.hgetall("interests:0"))
+        with mock.patch.object(self.redis, "pipeline", wraps=self.redis.pipeline) as pipeline:
+            self.store.get_many([2, 4])
+            self.assertEqual(1, pipeline.call_count)
+            self.store.get_many([1, 2], datetime.date(2017, 7, 1))
+            self.assertEqual(3, pipeline.call_count)
+        self.assert_lookups(self.store)
+        self.assertFalse(self.redis.exists("interests:history:3"))
+
+    def test_backends(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for store in (MemoryStore(100), SQLiteStore(os.path.join(tmp.name, "scoring.db"))):
+            self.fill(store)
+            self.assert_lookups(store)
+
+    def test_request_date(self):
+        self.fill(self.store)
+        for date, expected in self.LOOKUPS:
+            arguments = {"client_ids": [1, 2, 3, 4]}
+            if date is not None:
+                arguments["date"] = date.strftime("%d.%m.%Y")
+            request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                       "arguments": arguments}
+            self.set_valid_auth(request)
+            self.assertEqual((expected, api.OK), self.get_response(request), date)
+
+
+class TestInterestsBatch(TestSuite):
+    def test_get_many(self):
+        self.store.set_interests_many({1: ["cars"], 2: ["pets", "otus"], 150: ["tv"]})
+        with mock.patch.object(self.redis, "pipeline", wraps=self.redis.pipeline) as pipeline:
+            result = self.store.get_many([1, 2, 2, 3, 150])
+        self.assertEqual({1: ["cars"], 2: ["pets", "otus"], 3: [], 150: ["tv"]}, result)
+        self.assertEqual(1, pipeline.call_count)
+
+    def test_layout(self):
+        self.store.set_interests(123, ["otus", "cars"])
+        self.store.set_interests(199, [])
+        self.assertEqual({b"23": b"1025", b"99": b"0"}, self.redis.hgetall("interests:1"))
+        self.assertEqual(["cars", "otus"], self.store.get(123))
+        self.assertEqual([], self.store.get(199))
+        self.assertEqual([], self.store.get(124))
+
+    def test_encode_interests(self):
+        self.assertEqual(0b110, encode_interests(["travel", "pets", "pets"]))
+        self.assertEqual(["pets", "travel"], decode_interests(b"6"))
+        self.assertEqual([], decode_interests(None))
+        self.assertRaises(ValueError, encode_interests, ["cars", "golf"])
+        self.assertRaises(ValueError, encode_interests, [None])
+
+    def test_only_failed_ids_are_retried(self):
+        calls = []
+        get_many = self.store.get_many
+
+        def flaky_get_many(cids, date=None):
+            calls.append(list(cids))
+            result = get_many(cids, date)
+            if len(calls) == 1:
+                result.pop(2)
+            return result
+
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2, 3]}}
+        self.set_valid_auth(request)
+        with mock.patch.object(self.store, "get_many", side_effect=flaky_get_many):
+            response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([[1, 2, 3], [2]], calls)
+        self.assertEqual(3, self.context["nclients"])
+
+
+class TestLocalCache(TestSuite):
+    def setUp(self):
+        super().setUp()
+        self.store = TestStore(self.redis, LocalCache(size=10, ttl=60))
+
+    def test_cache_get_is_served_locally(self):
+        self.redis.set("uid:1", 3)
+        with mock.patch.object(self.redis, "get", wraps=self.redis.get) as get:
+            self.assertEqual(b"3", self.store.cache_get("uid:1"))
+            self.assertEqual(b"3", self.store.cache_get("uid:1"))
+            self.assertIsNone(self.store.cache_get("uid:2"))
+        self.assertEqual(2, get.call_count)
+        self.assertEqual({"size": 1, "hits": 1, "misses": 2}, self.store.cache_stats())
+
+    def test_cache_set_fills_local_cache(self):
+        self.store.cache_set("uid:1", 1.5, 60 * 60)
+        with mock.patch.object(self.redis, "get") as get:
+            self.assertEqual("1.5", self.store.cache_get("uid:1"))
+        get.assert_not_called()
+
+    def test_zero_score_is_cached(self):
+        arguments = {"gender": 0, "birthday": "01.01.2000"}
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": arguments}
+        self.set_valid_auth(request)
+        with mock.patch.object(self.redis, "set", wraps=self.redis.set) as set:
+            for _ in range(3):
+                self.assertEqual(({"score": 0}, api.OK), self.get_response(request))
+        self.assertEqual(1, set.call_count)
+        self.assertEqual({"size": 1, "hits": 2, "misses": 1}, self.store.cache_stats())
+
+
+class TestCircuitBreaker(TestSuite):
+    def setUp(self):
+        super().setUp()
+        self.store = TestStore(self.redis, breaker=CircuitBreaker(threshold=2, reset_timeout=60))
+
+    def test_score_skips_cache_when_open(self):
+        arguments = {"phone": "79175002040", "email": "stupnikov@otus.ru"}
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": arguments}
+        self.set_valid_auth(request)
+        with (
+                mock.patch.object(self.redis, "get", side_effect=redis.ConnectionError) as get,
+                mock.patch.object(self.redis, "set", side_effect=redis.ConnectionError) as set
+        ):
+            for _ in range(3):
+                response, code = self.get_response(request)
+                self.assertEqual((api.OK, 3.0), (code, response["score"]))
+        self.assertEqual(1, get.call_count)
+        self.assertEqual(1, set.call_count)
+        self.assertEqual("open", self.store.breaker_stats()["state"])
+
+    def test_interests_fail_fast_when_open(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2, 3]}}
+        self.set_valid_auth(request)
+        pipe = mock.Mock(**{"execute.side_effect": redis.ConnectionError})
+        with mock.patch.object(self.redis, "pipeline", return_value=pipe):
+            _, code = self.get_response(request)
+        self.assertEqual(api.INTERNAL_ERROR, code)
+        self.assertEqual(2, pipe.execute.call_count)
+
+    def test_response_errors_do_not_open(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=60)
+        for _ in range(2):
+            self.assertRaises(redis.ResponseError, breaker.call, mock.Mock(side_effect=redis.ResponseError))
+        self.assertEqual({"state": "closed", "failures": 0, "trips": 0}, breaker.stats())
+        self.assertRaises(redis.TimeoutError, breaker.call, mock.Mock(side_effect=redis.TimeoutError))
+        self.assertEqual("open", breaker.state)
+
+    def test_interrupted_probe_reopens(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+        self.assertRaises(redis.ConnectionError, breaker.call, mock.Mock(side_effect=redis.ConnectionError))
+        self.assertRaises(KeyboardInterrupt, breaker.call, mock.Mock(side_effect=KeyboardInterrupt))
+        self.assertEqual("open", breaker.state)
+
+        async def cancelled():
+            raise asyncio.CancelledError
+
+        self.assertRaises(asyncio.CancelledError, asyncio.run, breaker.call_async(cancelled))
+        self.assertEqual("open", breaker.state)
+        self.assertEqual(1, breaker.call(mock.Mock(return_value=1)))
+        self.assertEqual("closed", breaker.state)
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = MonitoredConnectionPool(max_connections=2, timeout=0.01, connection_class=fakeredis.FakeConnection,
+                                            server=fakeredis.FakeServer())
+        self.store = Store(redis.StrictRedis(connection_pool=self.pool))
+
+    def test_pool_stats(self):
+        self.store.cache_set("key", 1, 60)
+        self.assertEqual({"max_connections": 2, "created": 1, "in_use": 0, "waits": 0}, self.store.pool_stats())
+        connections = [self.pool.get_connection("GET") for _ in range(2)]
+        self.assertRaises(redis.ConnectionError, self.store.cache_get, "key")
+        self.assertEqual({"max_connections": 2, "created": 2, "in_use": 2, "waits": 1}, self.store.pool_stats())
+        for connection in connections:
+            self.pool.release(connection)
+        self.assertEqual(b"1", self.store.cache_get("key"))
+
+    def test_pool_is_created_lazily(self):
+        with mock.patch("store._pool", None), mock.patch("store.get_connection_pool") as get_connection_pool:
+            store = Store()
+            get_connection_pool.assert_not_called()
+            store.redis
+            get_connection_pool.assert_called_once()
+
+    def test_connections_are_split_between_workers(self):
+        with mock.patch.dict(REDIS_CONFIG, {"max_connections": 32}), mock.patch("store._redis_workers", 1):
+            for _ in range(2):
+                configure_redis(workers=4, socket_timeout=2)
+                self.assertEqual(8, pool_size())
+            self.assertEqual(32, REDIS_CONFIG["max_connections"])
+            self.assertEqual(2, REDIS_CONFIG["socket_timeout"])
+
+
+class TestBatch(TestSuite):
+    def get_batch_response(self, requests):
+        return api.batch_handler({"body": requests, "headers": self.headers}, self.context, self.store)
+
+    def score_request(self, login="h&f", **arguments):
+        request = {"account": "horns&hoofs", "login": login, "method": "online_score", "arguments": arguments}
+        self.set_valid_auth(request)
+        return request
+
+    @cases([{}, [], "requests"])
+    def test_invalid_batch(self, body):
+        _, code = self.get_batch_response(body)
+        self.assertEqual(api.INVALID_REQUEST, code)
+
+    def test_scores_expire_at_different_times(self):
+        requests = [self.score_request(first_name="a", last_name=str(i)) for i in range(20)]
+        self.get_batch_response(requests)
+        ttls = {self.redis.ttl(key) for key in self.redis.keys("uid:*")}
+        self.assertGreater(len(ttls), 1)
+        self.assertTrue(all(ttl <= scoring.SCORE_TTL * (1 + scoring.SCORE_TTL_JITTER) for ttl in ttls))
+
+    def test_batch(self):
+        interests = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                     "arguments": {"client_ids": [1, 2]}}
+        self.set_valid_auth(interests)
+        requests = [
+            self.score_request(phone="79175002040", email="stupnikov@otus.ru"),
+            self.score_request(first_name="a", last_name="b"),
+            self.score_request(phone="79175002040"),
+            dict(self.score_request(first_name="a", last_name="b"), token="bad"),
+            self.score_request(login="admin", first_name="a", last_name="b"),
+            interests,
+            {},
+        ]
+        response, code = self.get_batch_response(requests)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([{"response": {"score": 3.0}, "code": 200},
+                          {"response": {"score": 0.5}, "code": 200},
+                          {"error": "_", "code": 422},
+                          {"error": "_", "code": 403},
+                          {"response": {"score": 42}, "code": 200}], response[:5])
+        self.assertEqual(200, response[5]["code"])
+        self.assertEqual([1, 2], sorted(response[5]["response"]))
+        self.assertEqual({"error": "_", "code": 422}, response[6])
+        self.assertEqual(7, self.context["batch_size"])
+
+    def test_auth_and_cache_round_trips(self):
+        requests = [self.score_request(first_name=name, last_name="b") for name in ("a", "b", "c")]
+        self.store.cache_set(scoring.get_score_key(None, None, None, "a", "b"), 1, 60)
+        with (
+                mock.patch("api.check_auth", wraps=api.check_auth) as check_auth,
+                mock.patch.object(self.redis, "mget", wraps=self.redis.mget) as mget,
+                mock.patch.object(self.redis, "pipeline", wraps=self.redis.pipeline) as pipeline
+        ):
+            response, code = self.get_batch_response(requests)
+        self.assertEqual([1.0, 0.5, 0.5], [r["response"]["score"] for r in response])
+        self.assertEqual(1, check_auth.call_count)
+        self.assertEqual(1, mget.call_count)
+        self.assertEqual(1, pipeline.call_count)
+        response, _ = self.get_batch_response(requests)
+        self.assertEqual([1.0, 0.5, 0.5], [r["response"]["score"] for r in response])
+
+
+class TestStream(TestSuite):
+    def test_stream(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"first_name": "a", "last_name": "b"}}
+        self.set_valid_auth(request)
+        lines = [json.dumps(request).encode()] * 5 + [b"", b"not json", b"[1]", json.dumps(request).encode()]
+        with mock.patch.object(self.redis, "mget", wraps=self.redis.mget) as mget:
+            chunks = list(api.stream_handler(iter(lines), self.store, chunk_size=3))
+        self.assertEqual(3, len(chunks))
+        self.assertEqual(3, mget.call_count)
+        results = [json.loads(line) for line in b"".join(chunks).splitlines()]
+        self.assertEqual([{"response": {"score": 0.5}, "code": 200}] * 5 + [{"error": "_", "code": 422}] * 2
+                         + [{"response": {"score": 0.5}, "code": 200}], results)
+
+    def test_iter_lines(self):
+        blocks = [b'{"a"', b': 1}\n{"b": 2}\n', b"\n{", b"}"]
+        self.assertEqual([b'{"a": 1}', b'{"b": 2}', b"", b"{}"], list(api.iter_lines(blocks)))
+
+    def test_read_chunked(self):
+        rfile = io.BytesIO(b"4\r\nabcd\r\n2;ext=1\r\nef\r\n0\r\n\r\n")
+        self.assertEqual([b"abcd", b"ef"], list(api.read_chunked(rfile)))
+        self.assertEqual(b"", rfile.read())
+
+
+class TestWarmup(TestSuite):
+    CSV = (b"phone,email,birthday,gender,first_name,last_name\n"
+           b"79175002040,stupnikov@otus.ru,01.01.2000,1,a,b\n"
+           b",,,,a,b\n"
+           b"79175002040,stupnikov@otus.ru,,,,\n"
+           b"79175002040,,,,,\n"
+           b",,01.01.2000,,,\n")
+
+    def warmup(self, source, fmt, chunk_size=2):
+        with mock.patch.object(self.redis, "pipeline", wraps=self.redis.pipeline) as pipeline:
+            progress = list(api.warmup_scores(api.read_people(io.BytesIO(source), fmt), self.store, chunk_size))
+        self.assertEqual(sum(1 for written, _ in progress if written), pipeline.call_count)
+        return progress
+
+    def test_csv(self):
+        self.assertEqual([(2, 0), (1, 2)], self.warmup(self.CSV, "csv"))
+        self.assert_scores_cached([
+            {"phone": "79175002040", "email": "stupnikov@otus.ru", "birthday": "01.01.2000", "gender": 1,
+             "first_name": "a", "last_name": "b"},
+            {"first_name": "a", "last_name": "b"},
+            {"phone": "79175002040", "email": "stupnikov@otus.ru"},
+        ])
+
+    def test_jsonl(self):
+        people = [{"phone": 79175002040, "email": "stupnikov@otus.ru"}, {"first_name": "a", "last_name": "b"}]
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": people[1]}
+        lines = [json.dumps(people[0]).encode(), b"", b"not json", json.dumps(request).encode(), b"[1]"]
+        self.assertEqual([(2, 1), (0, 1)], self.warmup(b"\n".join(lines), "jsonl"))
+        self.assert_scores_cached(people)
+
+    def assert_scores_cached(self, people):
+        """The cache holds exactly the scores online_score returns for `people`, and they are read from it."""
+        keys = set()
+        for arguments in people:
+            request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": arguments}
+            self.set_valid_auth(request)
+            with mock.patch("scoring.calculate_score") as calculate_score:
+                response, code = self.get_response(request)
+            self.assertEqual(api.OK, code)
+            calculate_score.assert_not_called()
+            person = api.valid_person(arguments)
+            key = scoring.get_score_key(person[0], person[1], person[2], person[4], person[5])
+            self.assertEqual(response["score"], float(self.redis.get(key)))
+            keys.add(key.encode())
+        self.assertEqual(keys, set(self.redis.keys("uid:*")))
+
+
+class TestLoadInterests(TestSuite):
+    def load(self, source, fmt):
+        return list(api.load_interests(api.read_interests(io.BytesIO(source), fmt), self.store, chunk_size=2))
+
+    def test_csv(self):
+        source = b"client_id,interests\n1,cars pets\n2,\nx,cars\n3,golf\n"
+        self.assertEqual([(2, 0), (0, 2)], self.load(source, "csv"))
+        self.assertEqual({1: ["cars", "pets"], 2: [], 3: []}, self.store.get_many([1, 2, 3]))
+
+    def test_jsonl(self):
+        lines = [b'{"client_id": 1, "interests": ["tv"]}', b"", b"not json", b'{"client_id": "2", "interests": []}',
+                 b'{"client_id": 5, "interests": ["otus"]}', b'{"client_id": 1, "interests": ["cars"]}']
+        self.assertEqual([(2, 2), (1, 0)], self.load(b"\n".join(lines), "jsonl"))
+        self.assertEqual({1: ["cars"], 2: [], 5: ["otus"]}, self.store.get_many([1, 2, 5]))
+
+    def test_snapshots(self):
+        lines = [b'{"client_id": 1, "interests": ["tv"], "date": "20.07.2017"}',
+                 b'{"client_id": 2, "interests": ["otus"]}',
+                 b'{"client_id": 1, "interests": ["cars"], "date": "01.07.2017"}',
+                 b'{"client_id": 3, "interests": ["cars"], "date": "32.07.2017"}']
+        self.assertEqual([(2, 0), (1, 1)], self.load(b"\n".join(lines), "jsonl"))
+        source = b"client_id,interests,date\n2,pets,10.07.2017\n"
+        self.assertEqual([(1, 0)], self.load(source, "csv"))
+        self.assertEqual({1: ["cars"], 2: ["pets"], 3: []}, self.store.get_many([1, 2, 3], datetime.date(2017, 7, 19)))
+        self.assertEqual({1: ["tv"], 2: ["pets"]}, self.store.get_many([1, 2]))
+
+    def test_fill_memory_store(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "interests.csv")
+        with open(path, "w") as f:
+            f.write("client_id,interests,date\n1,cars,\n2,tv,\n1,pets,01.07.2017\n3,golf,\n")
+        config = dict(STORE_CONFIG, backend="memory", interests_file=path)
+        store = MemoryStore(100)
+        api.fill_memory_store(store, config)
+        self.assertEqual({1: ["pets"], 2: ["tv"], 3: []}, store.get_many([1, 2, 3]))
+        self.assertEqual(["cars"], store.get(1, datetime.date(2017, 6, 30)))
+        store = mock.Mock()
+        api.fill_memory_store(store, dict(config, backend="sqlite"))
+        api.fill_memory_store(store, dict(config, interests_file=None))
+        store.set_interests_many.assert_not_called()
+
+
+class TestBackends(TestSuite):
+    def backends(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return [MemoryStore(100), SQLiteStore(os.path.join(tmp.name, "scoring.db"))]
+
+    def test_cache(self):
+        for store in self.backends():
+            self.assertIsNone(store.cache_get("uid:1"))
+            store.cache_set("uid:1", 1.5, 60)
+            store.cache_set_many({"uid:2": 3.0, "uid:3": 0}, lambda: 60)
+            self.assertEqual("1.5", store.cache_get("uid:1"))
+            self.assertEqual(["3.0", None, "0", "1.5"], store.cache_get_many(["uid:2", "uid:4", "uid:3", "uid:1"]))
+            with mock.patch("time.time", return_value=time.time() + 61), \
+                    mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+                self.assertEqual([None, None], store.cache_get_many(["uid:1", "uid:2"]))
+
+    def test_handlers(self):
+        score = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                 "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        interests = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                     "arguments": {"client_ids": [1, 2, 3]}}
+        self.set_valid_auth(score)
+        self.set_valid_auth(interests)
+        for store in self.backends():
+            self.store = store
+            self.assertTrue(store.warmup())
+            store.set_interests_many({1: ["cars"], 3: ["pets", "tv"]})
+            for _ in range(2):
+                self.assertEqual(({"score": 3.0}, api.OK), self.get_response(score))
+            self.assertEqual("3.0", store.cache_get(scoring.get_score_key("79175002040", "stupnikov@otus.ru")))
+            response, code = self.get_response(interests)
+            self.assertEqual(({1: ["cars"], 2: [], 3: ["pets", "tv"]}, api.OK), (response, code))
+
+    def test_sqlite_is_shared_and_persistent(self):
+        first, = self.backends()[1:]
+        first.cache_set("uid:1", 1.5, 60)
+        first.set_interests(7, ["books"])
+        second = SQLiteStore(first.path)
+        self.assertEqual("1.5", second.cache_get("uid:1"))
+        self.assertEqual({7: ["books"], 8: []}, second.get_many([7, 8]))
+
+    def test_incomplete_backend_fails_on_creation(self):
+        class CacheOnly(BaseStore):
+            def cache_get(self, key):
+                return None
+
+        self.assertRaises(TypeError, CacheOnly)
+
+    def test_sqlite_schema_is_created_once(self):
+        store = self.backends()[1]
+        statements = []
+        connect = store.connect
+
+        def traced_connect():
+            db = connect()
+            db.set_trace_callback(statements.append)
+            return db
+
+        with mock.patch.object(store, "connect", side_effect=traced_connect) as connects:
+            threads = [threading.Thread(target=store.cache_get, args=("uid:1",)) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(3, connects.call_count)
+        self.assertEqual(3, len(statements))
+        self.assertTrue(all(statement.startswith("SELECT") for statement in statements))
+
+    def test_make_store(self):
+        config = dict(STORE_CONFIG, backend="redis")
+        self.assertIsInstance(make_store(config), Store)
+        self.assertIsInstance(make_store(dict(config, backend="memory")), MemoryStore)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        sqlite = dict(config, backend="sqlite", path=os.path.join(tmp.name, "scoring.db"))
+        self.assertIsInstance(make_store(sqlite), SQLiteStore)
+        self.assertRaises(ValueError, make_store, dict(config, backend="lmdb"))
+
 
 class TestDB(TestSuite):
     def get_response(self, request):
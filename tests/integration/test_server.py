@@ -0,0 +1,203 @@
+import hashlib
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+import fakeredis
+
+import api
+from store import Store
+
+
+class Handler(api.MainHTTPHandler):
+    store = Store(fakeredis.FakeStrictRedis())
+    max_requests = 3
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestKeepAlive(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.connection = http.client.HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=5)
+        self.addCleanup(self.connection.close)
+        token = hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode()).hexdigest()
+        self.request = json.dumps({"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": token,
+                                   "arguments": {"first_name": "a", "last_name": "b"}})
+
+    def post(self):
+        self.connection.request("POST", "/method", self.request)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_connection_is_reused(self):
+        sockets = set()
+        for _ in range(2):
+            response, body = self.post()
+            sockets.add(self.connection.sock)
+            self.assertEqual(200, response.status)
+            self.assertEqual(11, response.version)
+            self.assertEqual(str(len(body)), response.headers["Content-Length"])
+            self.assertEqual({"response": {"score": 0.5}, "code": 200}, json.loads(body))
+        self.assertEqual(1, len(sockets))
+        self.assertIsNotNone(self.connection.sock)
+
+    def test_connection_is_closed_after_max_requests(self):
+        for _ in range(Handler.max_requests - 1):
+            response, _ = self.post()
+            self.assertIsNone(response.headers["Connection"])
+        response, _ = self.post()
+        self.assertEqual("close", response.headers["Connection"])
+        self.assertIsNone(self.connection.sock)
+
+    def test_max_requests_counts_every_request(self):
+        self.connection.request("GET", "/metrics")
+        self.connection.getresponse().read()
+        lines = [self.request.encode()]
+        self.connection.request("POST", "/stream", iter(lines), encode_chunked=True)
+        response = self.connection.getresponse()
+        response.read()
+        self.assertIsNone(response.headers["Connection"])
+        self.connection.request("GET", "/metrics")
+        response = self.connection.getresponse()
+        response.read()
+        self.assertEqual(200, response.status)
+        self.assertEqual(["close"], response.headers.get_all("Connection"))
+        self.assertIsNone(self.connection.sock)
+
+    def test_connection_is_closed_when_body_is_not_read(self):
+        for headers in ({"Transfer-Encoding": "chunked"}, {"Content-Length": "-1"}, {"Content-Length": "x"}):
+            self.connection.putrequest("POST", "/method")
+            for name, value in headers.items():
+                self.connection.putheader(name, value)
+            self.connection.endheaders(b"10\r\n" + self.request.encode()[:16] + b"\r\n0\r\n\r\n")
+            response = self.connection.getresponse()
+            response.read()
+            self.assertEqual("close", response.headers["Connection"], headers)
+            self.assertIsNone(self.connection.sock)
+            response, body = self.post()
+            self.assertEqual({"response": {"score": 0.5}, "code": 200}, json.loads(body))
+
+    def test_stream(self):
+        lines = [self.request.encode() + b"\n", b"not json\n", self.request.encode()]
+        self.connection.request("POST", "/stream", iter(lines), encode_chunked=True)
+        response = self.connection.getresponse()
+        self.assertEqual("chunked", response.headers["Transfer-Encoding"])
+        results = [json.loads(line) for line in response.read().splitlines()]
+        self.assertEqual([{"response": {"score": 0.5}, "code": 200}, {"error": "_", "code": 422},
+                          {"response": {"score": 0.5}, "code": 200}], results)
+        response, _ = self.post()
+        self.assertEqual(200, response.status)
+
+    def test_server_timing(self):
+        response, _ = self.post()
+        self.assertIsNone(response.headers["Server-Timing"])
+        with mock.patch.object(Handler, "server_timing", True):
+            response, _ = self.post()
+        phases = [metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")]
+        self.assertEqual(["parse", "validate", "auth", "store", "encode", "total"], phases)
+
+    def test_metrics(self):
+        api.METRICS.reset()
+        Handler.store.redis.flushall()
+        self.post()
+        self.connection.request("GET", "/metrics")
+        response = self.connection.getresponse()
+        body = response.read().decode()
+        self.assertEqual(200, response.status)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        self.assertIn('scoring_requests_total{method="online_score",code="200"} 1', body)
+        self.assertIn('scoring_request_duration_seconds_count{method="online_score"} 1', body)
+        self.assertIn('scoring_redis_command_duration_seconds_count{command="set"} 1', body)
+        self.assertIn('scoring_score_cache_total{result="miss"} 1', body)
+        self.assertIn("scoring_score_cache_hit_ratio 0.0", body)
+        self.connection.request("GET", "/other")
+        response = self.connection.getresponse()
+        response.read()
+        self.assertEqual(404, response.status)
+
+
+class TestCommandLine(unittest.TestCase):
+    api_path = os.path.join(os.path.dirname(os.path.abspath(api.__file__)), "api.py")
+
+    def tmp_dir(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return tmp.name
+
+    def start_server(self, *options, **env):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        process = subprocess.Popen([sys.executable, self.api_path, "-p", str(port), *options],
+                                   env=dict(os.environ, STORE_BACKEND="memory", **env), stderr=subprocess.DEVNULL)
+        self.addCleanup(process.wait, 10)
+        self.addCleanup(process.kill)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return process, port
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def test_async_mode_uses_command_line_settings(self):
+        access_log = os.path.join(self.tmp_dir(), "access.log")
+        process, port = self.start_server("--mode", "async", "--access-log", access_log, "--access-sample-rate", "0")
+        token = hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode()).hexdigest()
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": token}
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        self.addCleanup(connection.close)
+        for arguments in ({"first_name": "a", "last_name": "b"}, {}):
+            connection.request("POST", "/method", json.dumps(dict(request, arguments=arguments)))
+            connection.getresponse().read()
+        process.send_signal(signal.SIGINT)
+        process.wait(10)
+        with open(access_log) as f:
+            codes = [json.loads(line)["code"] for line in f]
+        # successful requests are not sampled at rate 0, errors are always written
+        self.assertEqual([api.INVALID_REQUEST], codes)
+
+    def test_memory_store_is_filled_at_start(self):
+        path = os.path.join(self.tmp_dir(), "interests.jsonl")
+        with open(path, "w") as f:
+            f.write('{"client_id": 1, "interests": ["cars"]}\n{"client_id": 2, "interests": ["tv", "otus"]}\n')
+        token = hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode()).hexdigest()
+        request = json.dumps({"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "token": token,
+                              "arguments": {"client_ids": [1, 2, 3]}})
+        for mode in ("thread", "async"):
+            process, port = self.start_server("--mode", mode, STORE_INTERESTS_FILE=path)
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("POST", "/method", request)
+            body = json.loads(connection.getresponse().read())
+            connection.close()
+            process.send_signal(signal.SIGINT)
+            process.wait(10)
+            self.assertEqual({"1": ["cars"], "2": ["tv", "otus"], "3": []}, body["response"], mode)
+
+    def test_offline_commands_refuse_memory_store(self):
+        for command in ("warmup", "interests"):
+            result = subprocess.run([sys.executable, self.api_path, command, os.devnull], capture_output=True,
+                                    env=dict(os.environ, STORE_BACKEND="memory"), timeout=10)
+            self.assertEqual(2, result.returncode, command)
+            self.assertIn(b"STORE_INTERESTS_FILE", result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
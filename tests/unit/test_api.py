@@ -1,7 +1,19 @@
+import datetime
 import functools
+import hashlib
+import itertools
+import logging
+import os
+import pstats
+import tempfile
 import unittest
+from unittest import mock
+
+import redis
 
 import api
+import serializer
+from store import CircuitBreaker, CircuitOpenError, LocalCache, make_local_cache
 
 
 def cases(cases):
@@ -15,70 +27,98 @@ def cases(cases):
     return decorator
 
 
+VALID_FIELDS = [
+    ("first_name", "a"),
+    ("email", "stupnikov@otus.ru"),
+    ("email", "stupnikov.s@otus.ru"),
+    ("phone", "79175002040"),
+    ("phone", 79175002040),
+    ("birthday", "01.01.2000"),
+    ("birthday", "1.1.2000"),
+    ("birthday", "29.02.2000"),
+    ("gender", 1),
+]
+
+INVALID_FIELDS = [
+    ("first_name", 1),
+    ("email", "stupnikovotus.ru"),
+    ("email", "Stupnikov@otus.ru"),
+    ("email", 1),
+    ("phone", "89175002040"),
+    ("phone", "7917500204"),
+    ("birthday", "01.01.1890"),
+    ("birthday", "XXX"),
+    ("birthday", "29.02.2001"),
+    ("birthday", "31.04.2000"),
+    ("birthday", "00.01.2000"),
+    ("birthday", "01.13.2000"),
+    ("birthday", "01.01.20000"),
+    ("birthday", "001.01.2000"),
+    ("birthday", " 1.01.2000"),
+    ("birthday", "01.01.2000 "),
+    ("birthday", "01-01-2000"),
+    ("birthday", 1012000),
+    ("gender", -1),
+]
+
+
 class TestValidation(unittest.TestCase):
-    class TestArgument(object):
-        def __init__(self, request):
-            self.value = request['value']
-            self.required = request['required']
-            self.nullable = request['nullable']
-
-    def test_validation_required__not_nullable(self):
-        request = TestValidation.TestArgument({'value': None, 'required': True, 'nullable': True})
-        body = {'One': 'First', 'Two': 'Second'}
-        argument = 'One'
-        expectation = 'First'
-        result = api.validation(request, body, argument)
-        self.assertEqual(expectation, result)
-
-    def test_validation_not_required__not_nullable(self):
-        request = TestValidation.TestArgument({'value': None, 'required': False, 'nullable': True})
-        body = {'One': 'First', 'Two': 'Second'}
-        argument = 'One'
-        expectation = 'First'
-        result = api.validation(request, body, argument)
-        self.assertEqual(expectation, result)
-
-    def test_validation_required__nullable(self):
-        request = TestValidation.TestArgument({'value': None, 'required': True, 'nullable': False})
-        body = {'One': 'First', 'Two': 'Second'}
-        argument = 'One'
-        expectation = 'First'
-        result = api.validation(request, body, argument)
-        self.assertEqual(expectation, result)
-
-    def test_validation_not_required__nullable(self):
-        request = TestValidation.TestArgument({'value': None, 'required': False, 'nullable': False})
-        body = {'One': 'First', 'Two': 'Second'}
-        argument = 'One'
-        expectation = 'First'
-        result = api.validation(request, body, argument)
-        self.assertEqual(expectation, result)
-
-    def test_validation_not_required__nullable_null(self):
-        request = TestValidation.TestArgument({'value': None, 'required': False, 'nullable': False})
-        body = {'One': None, 'Two': 'Second'}
-        argument = 'One'
-        self.assertRaises(ValueError, api.validation, request, body, argument)
-
-    def test_validation_required__not_nullable_null(self):
-        request = TestValidation.TestArgument({'value': None, 'required': True, 'nullable': True})
-        body = {'One': None, 'Two': 'Second'}
-        argument = 'One'
-        expectation = None
-        result = api.validation(request, body, argument)
-        self.assertEqual(expectation, result)
-
-    def test_validation_required_missed__nullable(self):
-        request = TestValidation.TestArgument({'value': None, 'required': True, 'nullable': False})
-        body = {'Two': 'Second'}
-        argument = 'One'
-        self.assertRaises(KeyError, api.validation, request, body, argument)
-
-    def test_validation_not_required_missed__nullable(self):
-        request = TestValidation.TestArgument({'value': None, 'required': False, 'nullable': False})
-        body = {'Two': 'Second'}
-        argument = 'One'
-        self.assertRaises(api.CustomException, api.validation, request, body, argument)
+    class SampleRequest(api.Request):
+        required = api.CharField(required=True, nullable=False)
+        required_nullable = api.CharField(required=True, nullable=True)
+        optional = api.CharField(required=False, nullable=False)
+        optional_nullable = api.CharField(required=False, nullable=True)
+
+    BODY = {
+        'required': 'First',
+        'required_nullable': 'Second',
+        'optional': 'Third',
+        'optional_nullable': 'Fourth',
+    }
+
+    def validate(self, **changes):
+        body = dict(self.BODY, **changes)
+        for name in [name for name, value in changes.items() if value is Ellipsis]:
+            del body[name]
+        return self.SampleRequest.validator(body)
+
+    def test_present_values_are_kept(self):
+        request, has, missing, invalid = self.validate()
+        self.assertEqual(sorted(self.BODY), sorted(has))
+        self.assertEqual(([], []), (missing, invalid))
+        for name, value in self.BODY.items():
+            self.assertEqual(value, getattr(request, name))
+
+    @cases(['required_nullable', 'optional_nullable'])
+    def test_nullable_accepts_null(self, name):
+        request, has, missing, invalid = self.validate(**{name: None})
+        self.assertIn(name, has)
+        self.assertEqual(([], []), (missing, invalid))
+        self.assertIsNone(getattr(request, name))
+
+    @cases(['required', 'optional'])
+    def test_not_nullable_rejects_null(self, name):
+        _, has, missing, invalid = self.validate(**{name: None})
+        self.assertNotIn(name, has)
+        self.assertEqual(([], [name]), (missing, invalid))
+
+    @cases(['required', 'required_nullable'])
+    def test_required_missing(self, name):
+        _, has, missing, invalid = self.validate(**{name: ...})
+        self.assertNotIn(name, has)
+        self.assertEqual(([name], []), (missing, invalid))
+
+    @cases(['optional', 'optional_nullable'])
+    def test_optional_missing(self, name):
+        request, has, missing, invalid = self.validate(**{name: ...})
+        self.assertNotIn(name, has)
+        self.assertEqual(([], []), (missing, invalid))
+        self.assertIsNone(getattr(request, name))
+
+    def test_invalid_value(self):
+        _, has, missing, invalid = self.validate(required=1)
+        self.assertNotIn('required', has)
+        self.assertEqual(([], ['required']), (missing, invalid))
 
 
 class TestPairValidation(unittest.TestCase):
@@ -98,3 +138,295 @@ class TestPairValidation(unittest.TestCase):
     ])
     def test_pair_valid_empty(self, arguments):
         self.assertRaises(ValueError, api.pair_validation, arguments)
+
+
+class TestRequest(unittest.TestCase):
+    def test_values_are_per_instance(self):
+        first, second = api.MethodRequest(), api.MethodRequest()
+        first.login = "first"
+        second.login = "second"
+        self.assertEqual("first", first.login)
+        self.assertEqual("second", second.login)
+        self.assertIsInstance(api.MethodRequest.login, api.CharField)
+        self.assertFalse(hasattr(api.MethodRequest.login, "value"))
+
+    @cases(VALID_FIELDS)
+    def test_valid_value_is_accepted(self, name, value):
+        request = api.OnlineScoreRequest()
+        setattr(request, name, value)
+        self.assertIsNotNone(getattr(request, name))
+
+    @cases(INVALID_FIELDS)
+    def test_invalid_value_is_rejected(self, name, value):
+        request = api.OnlineScoreRequest()
+        with self.assertRaises(ValueError):
+            setattr(request, name, value)
+        self.assertIsNone(getattr(request, name))
+
+    def test_date_parser_matches_strptime(self):
+        def strptime(value):
+            parts = value.split('.')
+            if len(parts) != 3 or not all(part.isdigit() for part in parts):
+                return None
+            try:
+                return datetime.datetime.strptime(value, '%d.%m.%Y').date()
+            except ValueError:
+                return None
+
+        def clean(value):
+            try:
+                return api.DateField().clean(value)
+            except ValueError:
+                return None
+
+        days = ["0", "00", "1", "01", "9", "10", "29", "30", "31", "32", "001", " 1", "1\n", "\u0661", "1\u0665"]
+        months = ["0", "1", "01", "02", "12", "13", "\u0662"]
+        years = ["2000", "2001", "0000", "1999", "20000", "200", "\u0662\u0660\u0660\u0660"]
+        for day, month, year in itertools.product(days, months, years):
+            value = f"{day}.{month}.{year}"
+            self.assertEqual(strptime(value), clean(value), value)
+
+    def test_today_is_cached_per_day(self):
+        first, second = datetime.date(2023, 10, 1), datetime.date(2023, 10, 2)
+        with (
+                mock.patch("api._today", (0.0, None)),
+                mock.patch("api.datetime.date", wraps=datetime.date) as mocked_date,
+                mock.patch("time.time") as mocked_time
+        ):
+            mocked_date.today.return_value = first
+            mocked_time.return_value = datetime.datetime(2023, 10, 1, 23, 59).timestamp()
+            self.assertEqual(first, api.today())
+            mocked_date.today.return_value = second
+            self.assertEqual(first, api.today())
+            mocked_time.return_value = datetime.datetime(2023, 10, 2).timestamp()
+            self.assertEqual(second, api.today())
+        self.assertEqual(2, mocked_date.today.call_count)
+
+    def test_values_are_cleaned(self):
+        request = api.OnlineScoreRequest()
+        request.phone = 79175002040
+        request.birthday = "01.01.2000"
+        self.assertEqual("79175002040", request.phone)
+        self.assertEqual(datetime.date(2000, 1, 1), request.birthday)
+
+    def test_unknown_server_mode(self):
+        self.assertRaises(ValueError, api.run_server, 8080, "gevent")
+
+
+class TestValidator(unittest.TestCase):
+    def test_valid_body(self):
+        request, has, missing, invalid = api.OnlineScoreRequest.validator({"phone": 79175002040, "gender": None})
+        self.assertEqual(["phone", "gender"], has)
+        self.assertEqual([], missing)
+        self.assertEqual([], invalid)
+        self.assertEqual("79175002040", request.phone)
+        self.assertIsNone(request.email)
+
+    def test_errors_are_collected(self):
+        _, has, missing, invalid = api.MethodRequest.validator({"login": 1, "method": None, "arguments": {}})
+        self.assertEqual([], has)
+        self.assertEqual(["token"], missing)
+        self.assertEqual(["login", "arguments", "method"], invalid)
+
+
+class TestLocalCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = LocalCache(size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual({"size": 2, "hits": 3, "misses": 1}, cache.stats())
+
+    def test_expiration(self):
+        cache = LocalCache(size=2, ttl=60)
+        with mock.patch("time.monotonic", return_value=100):
+            cache.set("a", 1)
+            cache.set("b", 2, ttl=10)
+        with mock.patch("time.monotonic", return_value=120):
+            self.assertEqual(1, cache.get("a"))
+            self.assertIsNone(cache.get("b"))
+        with mock.patch("time.monotonic", return_value=160):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.stats()["size"])
+
+    def test_disabled(self):
+        self.assertIsNone(make_local_cache({"size": 0, "ttl": 60}))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(threshold=2, reset_timeout=5)
+
+    def fail(self):
+        self.assertRaises(redis.ConnectionError, self.breaker.call, mock.Mock(side_effect=redis.ConnectionError))
+
+    def test_opens_after_threshold(self):
+        self.fail()
+        self.assertEqual("closed", self.breaker.state)
+        self.fail()
+        self.assertEqual({"state": "open", "failures": 2, "trips": 1}, self.breaker.stats())
+        func = mock.Mock()
+        self.assertRaises(CircuitOpenError, self.breaker.call, func)
+        func.assert_not_called()
+
+    def test_success_resets_failures(self):
+        self.fail()
+        self.assertEqual(1, self.breaker.call(mock.Mock(return_value=1)))
+        self.fail()
+        self.assertEqual("closed", self.breaker.state)
+
+    def test_half_open_probe(self):
+        with mock.patch("time.monotonic", return_value=100):
+            self.fail()
+            self.fail()
+        with mock.patch("time.monotonic", return_value=106):
+            self.fail()
+            self.assertEqual("open", self.breaker.state)
+            self.assertRaises(CircuitOpenError, self.breaker.call, mock.Mock())
+        with mock.patch("time.monotonic", return_value=112):
+            self.assertEqual(1, self.breaker.call(mock.Mock(return_value=1)))
+        self.assertEqual({"state": "closed", "failures": 0, "trips": 2}, self.breaker.stats())
+
+
+class TestAuth(unittest.TestCase):
+    def request(self, **values):
+        request = api.MethodRequest()
+        for name, value in values.items():
+            setattr(request, name, value)
+        return request
+
+    def test_user_digest_is_cached(self):
+        token = hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode()).hexdigest()
+        api.user_digest.cache_clear()
+        for _ in range(3):
+            self.assertTrue(api.check_auth(self.request(account="horns&hoofs", login="h&f", token=token)))
+        self.assertFalse(api.check_auth(self.request(account="horns&hoofs", login="h&f", token="bad")))
+        self.assertEqual(1, api.user_digest.cache_info().misses)
+
+    @cases([
+        {"login": "h&f", "token": "x"},
+        {"account": "horns&hoofs", "login": "h&f"},
+        {"account": "horns&hoofs", "login": "h&f", "token": "не токен"},
+    ])
+    def test_bad_credentials(self, values):
+        self.assertFalse(api.check_auth(self.request(**values)))
+
+    def test_admin_digest_rotates_every_hour(self):
+        def token(hour):
+            return hashlib.sha512((hour + api.ADMIN_SALT).encode()).hexdigest()
+
+        first = datetime.datetime(2023, 10, 1, 12, 59, 59)
+        second = datetime.datetime(2023, 10, 1, 13, 0, 0)
+        with (
+                mock.patch("api._admin_digest", (0.0, None)),
+                mock.patch("api.datetime.datetime", wraps=datetime.datetime) as mocked_datetime,
+                mock.patch("time.time") as mocked_time
+        ):
+            mocked_datetime.now.return_value = first
+            mocked_time.return_value = first.timestamp()
+            self.assertTrue(api.check_auth(self.request(login="admin", token=token("2023100112"))))
+            mocked_datetime.now.return_value = second
+            self.assertTrue(api.check_auth(self.request(login="admin", token=token("2023100112"))))
+            mocked_time.return_value = second.timestamp()
+            self.assertFalse(api.check_auth(self.request(login="admin", token=token("2023100112"))))
+            self.assertTrue(api.check_auth(self.request(login="admin", token=token("2023100113"))))
+
+
+class TestAccessLog(unittest.TestCase):
+    def setUp(self):
+        root = logging.getLogger()
+        self.saved = root.handlers[:], root.level, api.ACCESS_LOG_SAMPLE_RATE
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def tearDown(self):
+        api.stop_logging()
+        root = logging.getLogger()
+        root.handlers[:], level, api.ACCESS_LOG_SAMPLE_RATE = self.saved
+        root.setLevel(level)
+        api.ACCESS_LOG.handlers[:] = []
+
+    def entry(self, code=api.OK):
+        return {"request_id": "1", "path": "/method/", "method": "online_score", "code": code, "duration_ms": 0.5}
+
+    def read(self, name):
+        with open(os.path.join(self.tmp.name, name)) as f:
+            return f.read().splitlines()
+
+    def test_formatter(self):
+        record = logging.LogRecord("access", logging.INFO, __file__, 1, "access", None, None)
+        record.entry = self.entry()
+        line = serializer.loads(api.LogFormatter().format(record))
+        self.assertEqual(dict(self.entry(), time=line["time"]), line)
+        record = logging.LogRecord("root", logging.INFO, __file__, 1, "%s started", ("server",), None)
+        self.assertTrue(api.LogFormatter().format(record).endswith("] I server started"))
+
+    def test_records_are_formatted_by_listener(self):
+        handler = api.LazyQueueHandler(mock.Mock())
+        record = logging.LogRecord("root", logging.INFO, __file__, 1, "%s", (["lazy"],), None)
+        self.assertIs(record, handler.prepare(record))
+        self.assertEqual((["lazy"],), record.args)
+
+    def test_access_log_file(self):
+        log, access_log = os.path.join(self.tmp.name, "app.log"), os.path.join(self.tmp.name, "access.log")
+        api.setup_logging(log, access_log)
+        logging.info("server started")
+        logging.debug("not written")
+        api.log_access(self.entry())
+        api.stop_logging()
+        self.assertEqual(1, len(self.read("app.log")))
+        self.assertIn("server started", self.read("app.log")[0])
+        entries = [serializer.loads(line) for line in self.read("access.log")]
+        self.assertEqual([self.entry()["request_id"]], [entry["request_id"] for entry in entries])
+
+    def test_stop_closes_files(self):
+        listener = api.setup_logging(os.path.join(self.tmp.name, "app.log"), os.path.join(self.tmp.name, "access.log"))
+        files = [handler.stream for handler in listener.handlers]
+        api.stop_logging()
+        self.assertTrue(all(f.closed for f in files))
+        self.assertFalse(any(isinstance(handler, api.LazyQueueHandler)
+                             for handler in logging.getLogger().handlers + api.ACCESS_LOG.handlers))
+        api.stop_logging()
+
+    def test_sampling_keeps_errors(self):
+        api.setup_logging(os.path.join(self.tmp.name, "app.log"), sample_rate=0.5)
+        with mock.patch("random.random", return_value=0.7):
+            api.log_access(self.entry())
+            api.log_access(self.entry(api.INTERNAL_ERROR))
+        with mock.patch("random.random", return_value=0.2):
+            api.log_access(self.entry())
+        api.stop_logging()
+        codes = [serializer.loads(line)["code"] for line in self.read("app.log")]
+        self.assertEqual([api.INTERNAL_ERROR, api.OK], codes)
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_sampled_requests_are_dumped(self):
+        profiler = api.Profiler(1, self.tmp.name, dump_every=2)
+        self.assertEqual(3, profiler.run(sum, [1, 2]))
+        self.assertFalse(os.path.exists(profiler.path))
+        profiler.run(sum, [1, 2])
+        self.assertTrue(os.path.exists(profiler.path))
+        stats = pstats.Stats(profiler.path)
+        self.assertEqual(2, sum(calls for (_, _, name), (calls, *_) in stats.stats.items() if "sum" in name))
+
+    def test_one_request_is_profiled_at_a_time(self):
+        profiler = api.Profiler(1, self.tmp.name, dump_every=1)
+        with profiler.lock:
+            self.assertEqual(3, profiler.run(sum, [1, 2]))
+        self.assertEqual(0, profiler.profiled)
+        with mock.patch("random.random", return_value=0.5):
+            profiler.rate = 0.5
+            profiler.run(sum, [1, 2])
+        self.assertEqual(0, profiler.profiled)
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(api.make_profiler(dict(api.PROFILE_CONFIG, rate=0)))
@@ -0,0 +1,78 @@
+import datetime
+import itertools
+import unittest
+from unittest import mock
+
+import bulk_scoring
+from scoring import calculate_score, get_score, get_score_key
+
+ROWS = list(itertools.product(
+    [None, "", "79175002040"],
+    [None, "stupnikov@otus.ru"],
+    [None, datetime.date(2000, 1, 1), datetime.date(1990, 12, 31)],
+    [None, 0, 1, 2],
+    [None, "", "a"],
+    [None, "b"],
+))
+
+
+class TestBulkScoring(unittest.TestCase):
+    def check(self, columns, rows=ROWS):
+        keys, scores = bulk_scoring.score_bulk(columns)
+        self.assertEqual([get_score_key(p, e, b, f, ln) for p, e, b, g, f, ln in rows], keys)
+        self.assertEqual([calculate_score(*row) for row in rows], list(scores))
+
+    def test_rows(self):
+        self.check(bulk_scoring.columns_from_rows(ROWS))
+
+    def test_without_numpy(self):
+        with mock.patch("bulk_scoring.numpy", None):
+            self.check(bulk_scoring.columns_from_rows(ROWS))
+
+    @unittest.skipIf(bulk_scoring.numpy is None, "NumPy is not installed")
+    def test_numpy_columns(self):
+        numpy = bulk_scoring.numpy
+        columns = {field: numpy.array(values, dtype=object)
+                   for field, values in bulk_scoring.columns_from_rows(ROWS).items()}
+        self.check(columns)
+        scores = bulk_scoring.score_columns({"phone": numpy.array(["", "79175002040"]), "gender": numpy.array([0, 1]),
+                                             "birthday": numpy.array([datetime.date(2000, 1, 1)] * 2, dtype=object)})
+        self.assertEqual([0, 3], list(scores))
+
+    @unittest.skipIf(bulk_scoring.numpy is None, "NumPy is not installed")
+    def test_numpy_dates(self):
+        numpy = bulk_scoring.numpy
+        columns = bulk_scoring.columns_from_rows(ROWS)
+        columns["birthday"] = numpy.array([numpy.datetime64(b) if b else numpy.datetime64("NaT") for b in columns["birthday"]],
+                                          dtype="datetime64[D]")
+        self.check(columns)
+        columns["birthday"] = columns["birthday"].astype("datetime64[s]")
+        self.check(columns)
+
+    def test_csv(self):
+        lines = [",".join(bulk_scoring.FIELDS)]
+        for row in ROWS:
+            lines.append(",".join("" if value is None else value.strftime("%d.%m.%Y") if isinstance(value, datetime.date)
+                                  else str(value) for value in row))
+        self.check(bulk_scoring.columns_from_csv(lines))
+
+    def test_arrow(self):
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        # with nulls the columns are lists, without them NumPy arrays, the dates datetime64
+        for rows in (ROWS, [row for row in ROWS if None not in row]):
+            table = pyarrow.table(bulk_scoring.columns_from_rows(rows))
+            self.check(bulk_scoring.columns_from_arrow(table), rows)
+
+    def test_equals_get_score(self):
+        store = mock.Mock()
+        store.cache_get.return_value = None
+        _, scores = bulk_scoring.score_bulk(bulk_scoring.columns_from_rows(ROWS))
+        self.assertEqual([get_score(mock.Mock(), store, *row) for row in ROWS], list(scores))
+
+    def test_missing_columns(self):
+        self.assertEqual([0.5, 0.5], list(bulk_scoring.score_columns({"first_name": ["a", "c"], "last_name": ["b", "d"]})))
+        self.assertEqual(([], []), tuple(map(list, bulk_scoring.score_bulk(bulk_scoring.columns_from_rows([])))))
+        self.assertRaises(ValueError, bulk_scoring.score_columns, {"phone": ["1"], "email": []})
@@ -0,0 +1,57 @@
+import threading
+import unittest
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = metrics.Metrics(buckets=(0.1, 1.0), shards=4)
+        self.metrics.describe("requests_total", "counter", "Requests.")
+        self.metrics.describe("latency_seconds", "histogram", "Latency.")
+
+    def test_counters_are_merged_across_threads(self):
+        def work():
+            for _ in range(1000):
+                self.metrics.inc("requests_total", (("method", "online_score"),))
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8000, self.metrics.counter("requests_total", (("method", "online_score"),)))
+        self.assertGreater(sum(1 for shard in self.metrics.shards if shard.counters), 1)
+
+    def test_render(self):
+        self.metrics.inc("requests_total", (("method", "online_score"), ("code", 200)), 2)
+        for value in (0.05, 0.1, 0.5, 3):
+            self.metrics.observe("latency_seconds", value, (("method", "online_score"),))
+        text = self.metrics.render([("ratio", "Ratio.", [((), 0.5)])])
+        self.assertEqual([
+            "# HELP latency_seconds Latency.",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{method="online_score",le="0.1"} 2',
+            'latency_seconds_bucket{method="online_score",le="1.0"} 3',
+            'latency_seconds_bucket{method="online_score",le="+Inf"} 4',
+            'latency_seconds_sum{method="online_score"} 3.65',
+            'latency_seconds_count{method="online_score"} 4',
+            "# HELP requests_total Requests.",
+            "# TYPE requests_total counter",
+            'requests_total{method="online_score",code="200"} 2',
+            "# HELP ratio Ratio.",
+            "# TYPE ratio gauge",
+            "ratio 0.5",
+        ], text.splitlines())
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual('{path="a\\\\b\\"c\\nd"}', metrics.format_labels((("path", 'a\\b"c\nd'),)))
+
+    def test_reset(self):
+        self.metrics.inc("requests_total")
+        self.metrics.reset()
+        self.assertEqual(({}, {}), self.metrics.collect())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,14 @@
+import asyncio
 import datetime
 import functools
 import random
+import threading
+import time
 import unittest
 from unittest import mock
 
-from scoring import get_interests, get_score
+import scoring
+from scoring import get_interests, get_interests_many, get_score, get_scores
 
 
 def cases(cases):
@@ -60,3 +64,109 @@ class TestScoring(unittest.TestCase):
             cid = random.randint(0, 10)
             result = get_interests(logging, mocked_store, cid)
             self.assertEqual(["cars", "pets"], result)
+
+    def test_get_interests_many(self):
+        with (
+                mock.patch("logging.info") as logging,
+                mock.patch("api.Store") as mocked_store,
+                mock.patch.object(mocked_store, 'get_many', return_value={1: ["cars", "pets"], 2: None})
+        ):
+            result = get_interests_many(logging, mocked_store, [1, 2])
+            self.assertEqual({1: ["cars", "pets"], 2: []}, result)
+
+    def test_get_interests_many_db_is_down(self):
+        with (
+                mock.patch("logging.info") as logging,
+                mock.patch("api.Store") as mocked_store,
+                mock.patch.object(mocked_store, 'get_many', side_effect=ConnectionError)
+        ):
+            self.assertRaises(ConnectionError, get_interests_many, logging, mocked_store, [1, 2])
+
+    def test_get_scores(self):
+        with (
+                mock.patch("logging.info") as logging,
+                mock.patch("api.Store") as mocked_store,
+                mock.patch.object(mocked_store, 'cache_get_many', return_value=[None, '2.5', None])
+        ):
+            people = [
+                ("79175002040", "example@otus.ru", None, None, None, None),
+                ("79175002040", None, None, None, None, None),
+                (None, None, datetime.date(2000, 1, 1), 1, "first", "last"),
+            ]
+            self.assertEqual([3, 2.5, 2], get_scores(logging, mocked_store, people))
+            mocked_store.cache_set_many.assert_called_once()
+            self.assertEqual([3, 2], list(mocked_store.cache_set_many.call_args[0][0].values()))
+
+
+class TestSingleFlight(unittest.TestCase):
+    def run_concurrently(self, target, number):
+        threads = [threading.Thread(target=target) for _ in range(number)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def test_concurrent_calls_share_one_result(self):
+        flight = scoring.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def compute():
+            started.set()
+            release.wait()
+            return 5
+
+        func = mock.Mock(side_effect=compute)
+        results = []
+        threads = self.run_concurrently(lambda: results.append(flight.do("uid:1", func)), 1)
+        started.wait()
+        threads += self.run_concurrently(lambda: results.append(flight.do("uid:1", func)), 4)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([5] * 5, results)
+        func.assert_called_once()
+        self.assertEqual({}, flight.calls)
+        self.assertEqual(6, flight.do("uid:1", lambda: 6))
+
+    def test_error_is_shared(self):
+        flight = scoring.SingleFlight()
+        self.assertRaises(ValueError, flight.do, "uid:1", mock.Mock(side_effect=ValueError))
+        self.assertEqual({}, flight.calls)
+
+    def test_get_score_coalesces_lookups(self):
+        release = threading.Event()
+        store = mock.Mock()
+
+        def cache_get(key):
+            release.wait()
+            return None
+
+        store.cache_get.side_effect = cache_get
+        results = []
+        threads = self.run_concurrently(
+            lambda: results.append(get_score(mock.Mock(), store, "79175002040", "example@otus.ru")), 5)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([3.0] * 5, results)
+        store.cache_get.assert_called_once()
+        store.cache_set.assert_called_once()
+
+    def test_get_score_async_coalesces_lookups(self):
+        store = mock.Mock()
+        store.cache_get = mock.AsyncMock(return_value=None)
+        store.cache_set = mock.AsyncMock()
+
+        async def lookups():
+            return await asyncio.gather(
+                *(scoring.get_score_async(mock.Mock(), store, "79175002040", "example@otus.ru") for _ in range(5)))
+
+        self.assertEqual([3.0] * 5, asyncio.run(lookups()))
+        store.cache_get.assert_awaited_once()
+        store.cache_set.assert_awaited_once()
+
+    def test_ttl_jitter(self):
+        ttls = {scoring.score_ttl() for _ in range(100)}
+        self.assertGreater(len(ttls), 1)
+        self.assertTrue(all(abs(ttl - scoring.SCORE_TTL) <= scoring.SCORE_TTL * scoring.SCORE_TTL_JITTER for ttl in ttls))
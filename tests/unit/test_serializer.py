@@ -0,0 +1,31 @@
+import unittest
+
+import serializer
+
+PAYLOADS = [
+    {"response": {"score": 3.0}, "code": 200},
+    {"response": {1: ["cars", "pets"], 2: ["тв", "geek"]}, "code": 200},
+    {"error": "The following filed(s) are invalid: phone", "code": 422},
+]
+
+
+class TestSerializer(unittest.TestCase):
+    def test_backends_agree(self):
+        for name, (dumps, loads) in serializer.BACKENDS.items():
+            for payload in PAYLOADS:
+                data = dumps(payload)
+                self.assertIsInstance(data, bytes, name)
+                self.assertEqual(serializer.json_loads(data), loads(data), name)
+                self.assertEqual(serializer.json_loads(serializer.json_dumps(payload)), loads(data), name)
+
+    def test_loads_rejects_invalid_json(self):
+        for name, (_, loads) in serializer.BACKENDS.items():
+            self.assertRaises(ValueError, loads, b'{"account": ')
+
+    def test_default_backend(self):
+        self.assertIn(serializer.BACKEND, serializer.BACKENDS)
+        self.assertEqual(serializer.BACKENDS[serializer.BACKEND], (serializer.dumps, serializer.loads))
+
+
+if __name__ == "__main__":
+    unittest.main()